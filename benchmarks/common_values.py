@@ -0,0 +1,82 @@
+# common_values.py - kantag common tag value micro-benchmark.
+# Copyright (C) 2018 David Gasaway
+# https://github.com/dgasaway/kantag
+
+# This program is free software; you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program; if not,
+# see <http://www.gnu.org/licenses>.
+#
+# Run from the source folder, e.g., 'python benchmarks/common_values.py'.  To compare with another
+# version, run it with PYTHONPATH set to that version's source folder.
+import sys
+import os
+import time
+import argparse
+
+if 'PYTHONPATH' not in os.environ:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from kantag.listdict import ListDict
+from kantag.tagset import TagSet
+
+# --------------------------------------------------------------------------------------------------
+def make_tracks(count, cls):
+    """
+    Return the tags of 'count' synthetic tracks of a release, as instances of 'cls'.  Each track has
+    60 single-value tags, of which every third differs between tracks, and a Performer list of 60
+    values, of which 45 are shared by all tracks.
+    """
+    tracks = []
+    for i in range(count):
+        tags = cls()
+        for n in range(60):
+            tags.append('Tag{0}'.format(n), 'Value {0}'.format(i if n % 3 == 0 else n))
+        for n in range(60):
+            tags.append('Performer', 'Performer {0}'.format(n if n < 45 else (i, n)))
+        tracks.append(tags)
+    return tracks
+
+# --------------------------------------------------------------------------------------------------
+def best_time(func, repeat):
+    """
+    Return the shortest of 'repeat' timed calls of a function.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+# --------------------------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measures the time to find the tag values common to the tracks of a release.')
+    parser.add_argument('-n', '--tracks',
+        help='number of tracks [default 500]',
+        type=int, default=500)
+    parser.add_argument('-r', '--repeat',
+        help='number of runs, of which the best is reported [default 5]',
+        type=int, default=5)
+    args = parser.parse_args()
+
+    tracks = make_tracks(args.tracks, TagSet)
+    lists = make_tracks(args.tracks, ListDict)
+    if TagSet.get_common_values(tracks) != ListDict.get_common_values(lists):
+        sys.exit('error: TagSet and ListDict common values differ')
+
+    for name, cls, dicts in (('TagSet', TagSet, tracks), ('ListDict', ListDict, lists)):
+        elapsed = best_time(lambda: cls.get_common_values(dicts), args.repeat)
+        print('{0} tracks: {1}.get_common_values: best of {2}: {3:.2f} ms'.format(
+            args.tracks, name, args.repeat, elapsed * 1000))
+
+# --------------------------------------------------------------------------------------------------
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# parse_tagfile.py - kantag tag file parsing micro-benchmark.
+# Copyright (C) 2018 David Gasaway
+# https://github.com/dgasaway/kantag
+
+# This program is free software; you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program; if not,
+# see <http://www.gnu.org/licenses>.
+#
+# Run from the source folder, e.g., 'python benchmarks/parse_tagfile.py'.  To compare with another
+# version, run it with PYTHONPATH set to that version's source folder.
+import sys
+import os
+import io
+import time
+import argparse
+
+if 'PYTHONPATH' not in os.environ:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from kantag.tagfile import TagFileBuilder
+
+# --------------------------------------------------------------------------------------------------
+def make_tag_file(count):
+    """
+    Return the text of a synthetic tag file with 'count' lines: 75% track lines, with single
+    numbers, ranges and disc-track numbers, 20% album lines, and 5% comments.
+    """
+    lines = []
+    for i in range(count):
+        kind = i % 20
+        if kind == 0:
+            lines.append('# Comment line {0}'.format(i))
+        elif kind < 5:
+            lines.append('a Tag{0}=Album value {1}'.format(kind, i))
+        elif kind < 10:
+            lines.append('t {0:02} Title=Song title {1}'.format(i % 99 + 1, i))
+        elif kind < 15:
+            lines.append('t 01-03,05,{0:02} Performer=Performer {1}|Performer, The'.format(
+                i % 90 + 7, i))
+        else:
+            lines.append('t {0}{1:02} Composer=Composer {2}'.format(i % 3 + 1, i % 99 + 1, i))
+    return '\n'.join(lines) + '\n'
+
+# --------------------------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measures the rate at which tag file lines are parsed.')
+    parser.add_argument('-n', '--lines',
+        help='number of lines in the tag file [default 100000]',
+        type=int, default=100000)
+    parser.add_argument('-r', '--repeat',
+        help='number of runs, of which the best is reported [default 3]',
+        type=int, default=3)
+    args = parser.parse_args()
+
+    text = make_tag_file(args.lines)
+    best = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        TagFileBuilder(reader=io.StringIO(text), warn=False)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print('{0} lines: best of {1}: {2:.3f} s, {3:,.0f} lines/s'.format(
+        args.lines, args.repeat, best, args.lines / best))
+
+# --------------------------------------------------------------------------------------------------
+if __name__ == "__main__":
+    main()
@@ -20,13 +20,16 @@ import codecs
 import os
 import re
 import pprint
+import time
+import difflib
+from concurrent.futures import ThreadPoolExecutor, Future
 from argparse import ArgumentParser
 from pathlib import Path
 from kantag import util
 from kantag.tagfile import TagFileBuilder
 from kantag.util import ToggleAction
 from kantag.exceptions import TaggingError
-from kantag import audiofile
+from kantag import audiofile, tagcache, manifest
 from kantag._version import __version__
 
 """
@@ -106,6 +109,9 @@ def main():
         print('<Arguments>')
         print(pprint.PrettyPrinter(indent=2).pformat(vars(args)) + '\n')
 
+    if args.cache:
+        audiofile.set_cache(tagcache.open_cache(warn=args.warn))
+
     try:
         process_files(args)
     except TaggingError as e:
@@ -113,11 +119,12 @@ def main():
         exit(2)
 
 # --------------------------------------------------------------------------------------------------
-def parse_args():
+def parse_args(argv=None, prog=None):
     """
-    Parse and return the command line arguments.
+    Parse and return the command line arguments, or the given list of arguments, in which case the
+    program name shown in messages should also be given.
     """
-    parser = ArgumentParser(
+    parser = ArgumentParser(prog=prog,
         description='Reads the tag_file and applies the tags to the audio ' +
         '(Ogg Vorbis, Ogg Opus, FLAC, MP3, or M4A) files.')
     parser.add_argument('--version', action='version', version='%(prog)s ' + __version__)
@@ -127,6 +134,18 @@ def parse_args():
     parser.add_argument('-p', '--pretend',
         help='do not modify the audio files',
         action='store_true', default=False)
+    parser.add_argument('-s', '--skip-unchanged',
+        help='do not write files that already contain the tags, and report the number of files '
+        'written and unchanged',
+        action='store_true', default=False)
+    parser.add_argument('-i', '--incremental',
+        help='keep a manifest of the tags applied next to the tag file (<tag_file>' +
+        manifest.manifest_suffix + '), and only write files whose tags changed or that were '
+        'modified since the last run',
+        action='store_true', default=False)
+    parser.add_argument('--no-cache',
+        help='do not use or update the tag cache',
+        action='store_false', dest='cache', default=True)
     parser.add_argument('-1', '--single-file',
         help='enable single file mode that does not require a track number',
         action='store_true', default=False)
@@ -136,8 +155,20 @@ def parse_args():
         'expression parses a filename in the form "<disc><track> - title.ext", where <track> must '
         'be two digits and <disc> may be zero or more digits',
         metavar='EXPRESSION', action='store', type=str, default=disc_track_regex())
+    parser.add_argument('-j', '--jobs',
+        help='number of files to write concurrently [default=1]',
+        metavar='N', action='store', type=int, default=1)
+    parser.add_argument('-r', '--recursive',
+        help='treat tag_file as a folder, and apply every tag file (*.kan) found under it to the '
+        'supported audio files in the folder containing the tag file',
+        action='store_true', default=False)
+    parser.add_argument('--watch',
+        help='after applying the tags, keep running and re-apply the tag file, or each tag file '
+        'in recursive mode, whenever it is saved; only the files affected by the changed lines are '
+        'written',
+        action='store_true', default=False)
     parser.add_argument('tag_file',
-        help='kantag tag definition file, or "-" for STDIN',
+        help='kantag tag definition file, or "-" for STDIN; with --recursive, a folder',
         action='store')
     parser.add_argument('audio_files',
         help='audio files (Ogg Vorbis, Ogg Opus, FLAC, MP3, M4A); if not provided, writes the '
@@ -172,10 +203,28 @@ def parse_args():
         help='disable warnings about unused lines from the tag file',
         action='store_false', dest='warn_unused', default=True)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+
+    if args.jobs < 1:
+        parser.error('number of jobs must be at least 1')
+
+    # The folder whose supported audio files are the audio files, if they were not given, which
+    # watch mode scans again for added files on each change.
+    args.audio_folder = None
+
+    # In recursive mode, the tag files and audio files are found while processing.
+    if args.recursive:
+        if not os.path.isdir(args.tag_file):
+            parser.error('folder not found: ' + args.tag_file)
+        if len(args.audio_files) > 0:
+            parser.error('audio files may not be given with --recursive')
+        args.tag_file = Path(args.tag_file)
+        return args
 
     # Check for tags to read.
-    if args.tag_file == '-':
+    if args.tag_file == '-' and args.watch:
+        parser.error('STDIN may not be used with --watch')
+    elif args.tag_file == '-':
         sys.stdin.reconfigure(encoding='utf-8')
     elif os.path.isfile(args.tag_file):
         args.tag_file = Path(args.tag_file)
@@ -189,6 +238,7 @@ def parse_args():
         args.audio_files = util.expand_globs(args.audio_files)
     elif args.tag_file != '-':
         args.audio_files = util.get_supported_audio_files(args.tag_file.parent)
+        args.audio_folder = args.tag_file.parent
 
     # If we still don't have audio files, there's nothing to do.
     if (len(args.audio_files) == 0):
@@ -219,11 +269,10 @@ def build_work_part_title(tags):
     return title
 
 # --------------------------------------------------------------------------------------------------
-def write_tags_to_file(tags, filename, args):
+def display_tags(tags, args):
     """
-    Write a TagSet to an audio file.
+    Display a TagSet according to the verbosity level.
     """
-    # Display tags
     if args.verbose == 2:
         for tag, lst in tags.items():
             for value in lst:
@@ -231,9 +280,27 @@ def write_tags_to_file(tags, filename, args):
     elif args.verbose >= 3:
         print(pprint.PrettyPrinter(indent=2).pformat(tags))
 
-    # Write the tags to file.
+# --------------------------------------------------------------------------------------------------
+def write_tags_to_file(tags, filename, args, mfst=None):
+    """
+    Write a TagSet to an audio file.  Returns whether the file was (or, in pretend mode, would be)
+    written; in skip unchanged mode, a file that already contains the tags is not written.  If a
+    Manifest is given, a file is not written if the manifest shows the same tags were applied and
+    the file is unmodified since, and the manifest is updated for the files checked or written.
+    """
+    if mfst is not None and mfst.is_current(filename, tags):
+        return False
+
+    if args.skip_unchanged and audiofile.is_unchanged(filename, tags):
+        if mfst is not None and not args.pretend:
+            mfst.update(filename, tags)
+        return False
+
     if not args.pretend:
         audiofile.write(filename, tags)
+        if mfst is not None:
+            mfst.update(filename, tags)
+    return True
 
 # --------------------------------------------------------------------------------------------------
 def get_disc_track(regex, path):
@@ -253,11 +320,11 @@ def get_disc_track(regex, path):
     return (discnum, tracknum)
 
 # --------------------------------------------------------------------------------------------------
-def process_file(tagf, filename, args):
+def get_file_tags(tagf, filename, args):
     """
-    Write matching tags from a TagFile to an audiofile, where matching is based on disc/track number
-    from the filename, while also looking for certain inconsistencies that suggest issues with the
-    tag file.
+    Get a TagSet of the matching tags from a TagFile for an audio file, where matching is based on
+    disc/track number from the filename, while also looking for certain inconsistencies that suggest
+    issues with the tag file.  Returns None if the file should be skipped.
     """
     if args.verbose >= 1:
         print(filename)
@@ -268,7 +335,7 @@ def process_file(tagf, filename, args):
     if args.warn and tracknum is None and not args.single_file:
         print('warning: unable to determine track number from filename; file will be skipped',
             file=sys.stderr)
-        return
+        return None
 
     # Get the tags that apply to the file.
     tags = tagf.get_matching(discnum, tracknum)
@@ -297,23 +364,89 @@ def process_file(tagf, filename, args):
         if 'Work' in tags and not 'Composer' in tags:
             print('warning: work without composer', file=sys.stderr)
 
-    # Finalize.
-    write_tags_to_file(tags, filename, args)
+    display_tags(tags, args)
+    return tags
 
 # --------------------------------------------------------------------------------------------------
-def process_files(args):
+def process_file(tagf, filename, args, mfst=None):
     """
-    Write tags from the tags file to the selected files.  When all have been written, look for tags
-    in the file that were not used (usually a sign of a tag file issue).
+    Write matching tags from a TagFile to an audio file.  Returns whether the file was written, or
+    None if the file was skipped.
     """
-    if args.tag_file == '-':
-        reader = sys.stdin
-    else:
-        reader = io.open(args.tag_file, mode='rt', encoding='utf-8')
+    tags = get_file_tags(tagf, filename, args)
+    if tags is None:
+        return None
+    return write_tags_to_file(tags, filename, args, mfst)
+
+# --------------------------------------------------------------------------------------------------
+def submit_write(executor, tags, filename, args, mfst=None):
+    """
+    Submit a write of a TagSet to an audio file to the executor, or, if there is no executor, write
+    the file in the calling thread.  Returns a Future for the result of write_tags_to_file.
+    """
+    if executor is not None:
+        return executor.submit(write_tags_to_file, tags, filename, args, mfst)
+    future = Future()
+    try:
+        future.set_result(write_tags_to_file(tags, filename, args, mfst))
+    except TaggingError as e:
+        future.set_exception(e)
+    return future
 
+# --------------------------------------------------------------------------------------------------
+def process_files_concurrently(tagf, audio_files, args, executor, mfst=None, applied=None):
+    """
+    Write matching tags from a TagFile to audio files using a pool of worker threads, or in the
+    calling thread if the executor is None.  The matching tags are determined in file order, so
+    verbose output and warnings are displayed in file order, and only the writes themselves are
+    dispatched to the pool.  Write errors are reported per file, in file order, after all the
+    writes have finished.  If given a dictionary of the tags last applied to each file, as in watch
+    mode, a file is not written if its tags are unchanged, and the dictionary is updated for the
+    files written.  Returns a list of results as returned by process_file.
+    """
+    futures = []
+    for filename in audio_files:
+        tags = get_file_tags(tagf, filename, args)
+        if tags is None:
+            futures.append((filename, tags, None, None))
+        elif applied is not None and applied.get(filename) == tags:
+            futures.append((filename, tags, None, False))
+        else:
+            futures.append((filename, tags, submit_write(executor, tags, filename, args, mfst),
+                None))
+
+    results = []
+    failed = 0
+    for filename, tags, future, result in futures:
+        if future is None:
+            results.append(result)
+            continue
+        try:
+            results.append(future.result())
+        except TaggingError as e:
+            print('error: failed to write {0}: {1}'.format(filename, ';'.join(e.args)),
+                file=sys.stderr)
+            failed += 1
+            continue
+        if applied is not None:
+            applied[filename] = tags
+    if failed > 0:
+        raise TaggingError('failed to write {0} of {1} files'.format(failed, len(futures)))
+    return results
+
+# --------------------------------------------------------------------------------------------------
+def read_tag_file(tag_file, args):
+    """
+    Read a TagFile from a kantag file, or from STDIN if the file is "-".
+    """
     # Note that we work on a TagFile object rather than translating to a more structured TagStore
     # so that we preserve the ordering presented in the kantag file.
-    tagf = TagFileBuilder(reader=reader, warn=args.warn and args.warn_unrecognized).tags
+    warn = args.warn and args.warn_unrecognized
+    if tag_file == '-':
+        tagf = TagFileBuilder(reader=sys.stdin, warn=warn).tags
+    else:
+        with io.open(tag_file, mode='rt', encoding='utf-8') as reader:
+            tagf = TagFileBuilder(reader=reader, warn=warn).tags
 
     if args.verbose >= 3:
         print('<TagFile>')
@@ -322,14 +455,264 @@ def process_files(args):
     if args.sort_map is not None:
         tagf.apply_map(args.sort_map)
 
-    for filename in args.audio_files:
-        process_file(tagf, filename, args)
+    return tagf
+
+# --------------------------------------------------------------------------------------------------
+def process_tag_file(tag_file, audio_files, args, executor=None):
+    """
+    Write tags from a tags file to the selected files, using the executor for the writes, if
+    given.  When all have been written, look for tags in the file that were not used (usually a
+    sign of a tag file issue).  Returns a list of results as returned by process_file.
+    """
+    tagf = read_tag_file(tag_file, args)
+
+    # In incremental mode, the manifest is saved even if some writes fail, so that the files that
+    # were written are not written again.
+    mfst = None
+    if args.incremental and tag_file != '-':
+        mfst = manifest.Manifest(manifest.get_manifest_path(tag_file))
+    try:
+        if executor is not None:
+            results = process_files_concurrently(tagf, audio_files, args, executor, mfst)
+        else:
+            results = [process_file(tagf, filename, args, mfst) for filename in audio_files]
+    finally:
+        if mfst is not None and not args.pretend:
+            try:
+                mfst.save()
+            except OSError as e:
+                print('warning: unable to save manifest: ' + str(e), file=sys.stderr)
 
     # Search and warn about unused tag lines.
     if args.warn and args.warn_unused:
-        for source_line in [line.source_line for line in tagf.lines if not line.used]:
-            print('warning: unused tag line:', file=sys.stderr)
-            print(source_line, file=sys.stderr)
+        warn_unused_lines(tagf.lines)
+
+    return results
+
+# --------------------------------------------------------------------------------------------------
+def warn_unused_lines(lines):
+    """
+    Display a warning for each of the TagLines that was not used.
+    """
+    for source_line in [line.source_line for line in lines if not line.used]:
+        print('warning: unused tag line:', file=sys.stderr)
+        print(source_line, file=sys.stderr)
+
+# --------------------------------------------------------------------------------------------------
+def format_results(results):
+    """
+    Format a summary of a list of results as returned by process_file.
+    """
+    summary = '{0} files written'.format(results.count(True))
+    if results.count(False) > 0:
+        summary += ', {0} files unchanged'.format(results.count(False))
+    if results.count(None) > 0:
+        summary += ', {0} files skipped'.format(results.count(None))
+    return summary
+
+# --------------------------------------------------------------------------------------------------
+def process_library(args, executor=None):
+    """
+    Write tags from every tags file found under a folder to the supported audio files in the same
+    folder as each tags file, then display a summary for each tags file.  An error in one tags file
+    is reported, and does not prevent processing of the others.
+    """
+    summaries = []
+    failed = 0
+    for tag_file in sorted(args.tag_file.rglob('*.kan')):
+        if args.verbose >= 1:
+            print('<{0}>'.format(tag_file))
+
+        audio_files = util.get_supported_audio_files(tag_file.parent)
+        if len(audio_files) == 0:
+            summaries.append((tag_file, 'no matching audio files found'))
+            continue
+
+        try:
+            results = process_tag_file(tag_file, audio_files, args, executor)
+            summaries.append((tag_file, format_results(results)))
+        except TaggingError as e:
+            print('error: {0}: {1}'.format(tag_file, ';'.join(e.args)), file=sys.stderr)
+            summaries.append((tag_file, 'failed'))
+            failed += 1
+
+    for tag_file, summary in summaries:
+        print('{0}: {1}'.format(tag_file, summary))
+
+    if failed > 0:
+        raise TaggingError('failed to apply {0} of {1} tag files'.format(failed, len(summaries)))
+
+# --------------------------------------------------------------------------------------------------
+def get_line_keys(tagf):
+    """
+    Get a list of (line, key) tuples for the tag lines of a TagFile, where the key identifies the
+    content of the line for comparison with another revision of the file.
+    """
+    return [(line, (line.line_type, str(line.applies_to), line.tag, line.value))
+        for line in tagf.lines if line.line_type != '#']
+
+# --------------------------------------------------------------------------------------------------
+def get_changed_lines(old_keys, new_keys):
+    """
+    Compare the line keys of two revisions of a TagFile, as returned by get_line_keys, and return
+    the lines of either revision that were removed, added, or moved.
+    """
+    matcher = difflib.SequenceMatcher(
+        None, [key for line, key in old_keys], [key for line, key in new_keys], autojunk=False)
+    changed = []
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+        if op != 'equal':
+            changed.extend(line for line, key in old_keys[i1:i2])
+            changed.extend(line for line, key in new_keys[j1:j2])
+    return changed
+
+# --------------------------------------------------------------------------------------------------
+class WatchedTagFile(object):
+    """
+    State of a tag file in watch mode, kept between changes: the parsed lines, the audio files, and
+    the tags last applied to each audio file.  If a folder is given, the audio files are the
+    supported audio files in the folder, which is scanned again on each change.
+    """
+    def __init__(self, tag_file, audio_files, args, folder=None):
+        self.tag_file = tag_file
+        self.audio_files = audio_files
+        self.folder = folder
+        self.line_keys = []
+        self.applied = {}
+        self.manifest = None
+        if args.incremental:
+            self.manifest = manifest.Manifest(manifest.get_manifest_path(tag_file))
+
+# --------------------------------------------------------------------------------------------------
+def apply_watched(state, args, executor=None, full=False):
+    """
+    Re-read the tag file of a WatchedTagFile and write the audio files affected by the lines that
+    changed since the last read, and any audio files added to the folder, or all the audio files if
+    'full' is set, using the executor for the writes, if given.  A file is only written if its tags
+    differ from those last applied.  Returns a list of results as returned by process_file for the
+    affected files.
+    """
+    tagf = read_tag_file(state.tag_file, args)
+    line_keys = get_line_keys(tagf)
+
+    audio_files = state.audio_files
+    if state.folder is not None:
+        audio_files = util.get_supported_audio_files(state.folder)
+        for filename in set(state.applied) - set(audio_files):
+            del state.applied[filename]
+
+    if full:
+        changed = tagf.lines
+        affected = audio_files
+    else:
+        changed = get_changed_lines(state.line_keys, line_keys)
+        known = set(state.audio_files)
+        affected = []
+        for filename in audio_files:
+            (discnum, tracknum) = get_disc_track(args.path_regex, os.path.abspath(filename))
+            if filename not in known or any(line.applies(discnum, tracknum) for line in changed):
+                affected.append(filename)
+
+    try:
+        results = process_files_concurrently(
+            tagf, affected, args, executor, state.manifest, state.applied)
+    finally:
+        if state.manifest is not None and not args.pretend:
+            try:
+                state.manifest.save()
+            except OSError as e:
+                print('warning: unable to save manifest: ' + str(e), file=sys.stderr)
+
+    # The changes are only taken as applied once all the writes succeed, so that the files that
+    # failed are written again on the next change.
+    state.line_keys = line_keys
+    state.audio_files = audio_files
+
+    # Only a changed line can have become unused, since a line that applies to any of the files
+    # would have been used by the write of an affected file.
+    if args.warn and args.warn_unused:
+        changed_lines = set(id(line) for line in changed)
+        warn_unused_lines([line for line in tagf.lines if id(line) in changed_lines])
+
+    return results
+
+# --------------------------------------------------------------------------------------------------
+def watch_tag_files(args, executor=None):
+    """
+    Apply the tag file, or each tag file under the folder in recursive mode, then wait for tag
+    files to be saved and re-apply the changes, until interrupted.  The executor, if given, is used
+    for the writes.
+    """
+    from kantag import watch
+    states = {}
+    if args.recursive:
+        folder = args.tag_file
+        for tag_file in sorted(folder.rglob('*.kan')):
+            states[os.path.abspath(tag_file)] = \
+                WatchedTagFile(tag_file, [], args, tag_file.parent)
+    else:
+        folder = args.tag_file.parent
+        states[os.path.abspath(args.tag_file)] = \
+            WatchedTagFile(args.tag_file, args.audio_files, args, args.audio_folder)
+
+    watcher = watch.open_watcher([folder], args.recursive)
+    try:
+        for path, state in states.items():
+            try:
+                results = apply_watched(state, args, executor, True)
+            except TaggingError as e:
+                print('error: {0}: {1}'.format(path, ';'.join(e.args)), file=sys.stderr)
+                continue
+            print('{0}: {1}'.format(state.tag_file, format_results(results)), flush=True)
+        print('watching {0} for changes; press Ctrl+C to stop'.format(folder), flush=True)
+
+        while True:
+            for path in sorted(watch.wait_for_changes(watcher)):
+                if args.recursive and path.endswith('.kan') and path not in states:
+                    tag_file = Path(path)
+                    states[path] = WatchedTagFile(tag_file, [], args, tag_file.parent)
+                if path not in states:
+                    continue
+                if not os.path.isfile(path):
+                    # A tag file that is deleted is only watched again if it is re-created.
+                    if args.recursive:
+                        del states[path]
+                    continue
+
+                start = time.monotonic()
+                state = states[path]
+                try:
+                    results = apply_watched(state, args, executor, len(state.line_keys) == 0)
+                except TaggingError as e:
+                    print('error: {0}: {1}'.format(path, ';'.join(e.args)), file=sys.stderr)
+                    continue
+                print('{0}: {1} ({2:.0f} ms)'.format(state.tag_file, format_results(results),
+                    (time.monotonic() - start) * 1000), flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+# --------------------------------------------------------------------------------------------------
+def process_files(args):
+    """
+    Write tags from the tags file, or from each tags file in recursive mode, to the selected files.
+    """
+    # A single pool of worker threads is used for all the writes, even across tag files.
+    executor = ThreadPoolExecutor(max_workers=args.jobs) if args.jobs > 1 else None
+    try:
+        if args.watch:
+            watch_tag_files(args, executor)
+        elif args.recursive:
+            process_library(args, executor)
+        else:
+            results = process_tag_file(args.tag_file, args.audio_files, args, executor)
+            if args.skip_unchanged or args.incremental:
+                print('{0} files written, {1} files unchanged'.format(
+                    results.count(True), results.count(False)))
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
 # --------------------------------------------------------------------------------------------------
 if __name__ == "__main__":
@@ -14,36 +14,50 @@
 # see <http://www.gnu.org/licenses>.
 import sys
 import os
-import mutagen.id3
-import mutagen.oggvorbis
-import mutagen.oggopus
-import mutagen.flac
-import mutagen.easymp4
 from . import tagmaps, exceptions
 from .util import TagValue
 from .tagset import TagSet
 
+# The mutagen format modules are imported by the functions that use them, rather than here, so a
+# process only loads the modules for the formats of the files it reads or writes.
+
+""" Whether the additional MP4 keys have been registered with EasyMP4. """
+_mp4_keys_registered = False
+""" Map lower-case MP4 atom names to EasyMP4 keys, built on first use by _get_mp4_atoms. """
+_mp4_atoms = None
+""" Atom name prefix of the iTunes freeform keys. """
+_mp4_freeform_prefix = '----:com.apple.itunes:'
+
+""" TagCache used by read_raw and invalidated by write, or None if caching is disabled. """
+_cache = None
+
+# --------------------------------------------------------------------------------------------------
+def set_cache(cache):
+    """
+    Set the TagCache used to avoid re-reading unchanged files, or None to disable caching.
+    """
+    global _cache
+    _cache = cache
+
 # --------------------------------------------------------------------------------------------------
 def _map_tag(tag, warn):
     """
     Get the cannonical name for a tag.
     """
-    work = tag.lower()
-    if work in tagmaps.general_read_map:
-        work = tagmaps.general_read_map[work].lower()
-    l = [t for t in tagmaps.cannonical_tags if t.lower() == work]
-    if len(l) == 0:
+    cannonical = tagmaps.cannonical_lookup.get(tag.lower())
+    if cannonical is None:
         if warn:
             print('warning: unrecognized tag: ' + tag, file=sys.stderr)
         return tag
     else:
-        return l[0]
+        return cannonical
 
 # --------------------------------------------------------------------------------------------------
 def _break_text_frame(frame, tag):
     """
     Break a mutagen text frame into a list of TagValue named tuples.
     """
+    import mutagen.id3
     result = []
     if isinstance(frame.text, list):
         for value in frame.text:
@@ -111,6 +125,7 @@ def _break_frame(frame, ftype, warn):
     """
     Break a mutagen ID3 frame into a list of TagValue named tuples.
     """
+    import mutagen.id3
     # COMM can have different attributes like COMM:description:eng and so on, but we'll drop all
     # that since it can't be reproduced in a tag file.
     if ftype.startswith('COMM:'):
@@ -147,6 +162,7 @@ def _build_frame(tag, values, frame):
     """
     Build an mutagen ID3 frame from a tag name and associated values.
     """
+    import mutagen.id3
     if frame == 'TALB':
         return mutagen.id3.TALB(encoding=3, text=values)
     elif frame == 'TPE1':
@@ -221,6 +237,7 @@ def _read_oggvorbis(path, warn):
     """
     Read the existing tags from an ogg voribs file, and return a list of TagValue named tuples.
     """
+    import mutagen.oggvorbis
     result = []
     afile = mutagen.oggvorbis.OggVorbis(path)
     for item in afile.tags:
@@ -235,6 +252,7 @@ def _read_oggopus(path, warn):
     """
     Read the existing tags from an ogg opus file, and return a list of TagValue named tuples.
     """
+    import mutagen.oggopus
     result = []
     afile = mutagen.oggopus.OggOpus(path)
     for item in afile.tags:
@@ -249,6 +267,7 @@ def _read_flac(path, warn):
     """
     Read the existing tags from a flac file, and return a list of TagValue named tuples.
     """
+    import mutagen.flac
     # Ordinarily, FLAC stored embedded images in a separate block form the tags.  However, since
     # they do use vcomment tags, we'll check for the same as used in ogg vorbis.
     result = []
@@ -265,6 +284,7 @@ def _read_mp3(path, warn):
     """
     Read the existing tags from an mp3 file, and return a list of TagValue named tuples.
     """
+    import mutagen.id3
     result = []
     afile = mutagen.id3.ID3(path)
     afile.update_to_v24()
@@ -273,14 +293,25 @@ def _read_mp3(path, warn):
 
     return result
 
+# --------------------------------------------------------------------------------------------------
+def _register_mp4_keys():
+    """
+    Register additional keys not supported by EasyMP4 by default.  Only needed once per process.
+    """
+    import mutagen.easymp4
+    global _mp4_keys_registered
+    if not _mp4_keys_registered:
+        for name, key in tagmaps.mp4_map.items():
+            mutagen.easymp4.EasyMP4Tags.RegisterFreeformKey(key, name)
+        _mp4_keys_registered = True
+
 # --------------------------------------------------------------------------------------------------
 def _read_m4a(path, warn):
     """
     Read the existing tags from an m4a file, and return a list of TagValue named tuples.
     """
-    # Register additional keys not supported by EasyMP4 by default.
-    for name, key in tagmaps.mp4_map.items():
-        mutagen.easymp4.EasyMP4Tags.RegisterFreeformKey(key, name)
+    import mutagen.easymp4
+    _register_mp4_keys()
 
     # Note, embedded images are not stored in tags.
     result = []
@@ -290,9 +321,9 @@ def _read_m4a(path, warn):
     return result
 
 # --------------------------------------------------------------------------------------------------
-def read_raw(path, warn=True):
+def _read_raw(path, warn):
     """
-    Read the existing tags from an audio file, and return a list of TagValue named tuples.
+    Read the existing tags from an audio file, bypassing the cache.
     """
     ext = os.path.splitext(path)[1].lower()
     if ext == '.ogg':
@@ -308,6 +339,27 @@ def read_raw(path, warn=True):
     else:
         raise exceptions.FileTypeError('invalid file extension: ' + ext)
 
+# --------------------------------------------------------------------------------------------------
+def read_raw(path, warn=True):
+    """
+    Read the existing tags from an audio file, and return a list of TagValue named tuples.  If a
+    cache is set, and the file is unchanged since the cached read, the file is not opened.
+    """
+    if _cache is not None:
+        result = _cache.get(path)
+        if result is not None:
+            # Repeat the warnings that would have been displayed by reading the file.
+            if warn:
+                for item in result:
+                    if item.tag not in tagmaps.cannonical_tags:
+                        print('warning: unrecognized tag: ' + item.tag, file=sys.stderr)
+            return result
+
+    result = _read_raw(path, warn)
+    if _cache is not None:
+        _cache.put(path, result)
+    return result
+
 # --------------------------------------------------------------------------------------------------
 def read(path, warn=True):
     """
@@ -315,11 +367,33 @@ def read(path, warn=True):
     """
     return TagSet(read_raw(path, warn))
 
+# --------------------------------------------------------------------------------------------------
+def _comparable(tagvalues):
+    """
+    Build a dictionary from a list of TagValue named tuples for comparing the tags of files, keyed
+    by lower-case cannonical tag name.
+    """
+    return {tag.lower(): values for tag, values in TagSet(tagvalues).items()}
+
+# --------------------------------------------------------------------------------------------------
+def is_unchanged(path, tagset):
+    """
+    Return whether an audio file already holds the tags from a TagSet, such that writing the TagSet
+    would not change the tags.  Tag names in the TagSet are mapped as they would be when read back
+    from the file, and the order of tags is ignored, but the order of values for a tag is not.
+    """
+    # Note: A false result only means the file will be rewritten, so a format-specific difference
+    # that cannot be normalized here (e.g., M4A track numbers stored as integers) is harmless.
+    target = [TagValue(_map_tag(tag, False), value) for tag, values in tagset.items()
+        for value in values]
+    return _comparable(read_raw(path, False)) == _comparable(target)
+
 # --------------------------------------------------------------------------------------------------
 def _write_oggvorbis(path, tagset):
     """
     Write tags from a TagSet to an ogg file.
     """
+    import mutagen.oggvorbis
     afile = mutagen.oggvorbis.OggVorbis(path)
     afile.clear()
     for tag, values in tagset.items():
@@ -335,6 +409,7 @@ def _write_oggopus(path, tagset):
     """
     Write tags from a TagSet to an ogg file.
     """
+    import mutagen.oggopus
     afile = mutagen.oggopus.OggOpus(path)
     afile.clear()
     for tag, values in tagset.items():
@@ -350,6 +425,7 @@ def _write_flac(path, tagset):
     """
     Write tags from a TagSet to a flac file.
     """
+    import mutagen.flac
     afile = mutagen.flac.FLAC(path)
     afile.clear()
     for tag, values in tagset.items():
@@ -365,6 +441,7 @@ def _write_mp3(path, tagset):
     """
     Write tags from a TagSet to an mp3 file.
     """
+    import mutagen.id3
     try:
         afile = mutagen.id3.ID3(path)
     except mutagen.id3.ID3NoHeaderError:
@@ -382,10 +459,8 @@ def _write_m4a(path, tagset):
     """
     Write tags from a TagSet to an m4a file.
     """
-    # Register additional keys not supported by EasyMP4 by default.
-    for name, key in tagmaps.mp4_map.items():
-        mutagen.easymp4.EasyMP4Tags.RegisterFreeformKey(key, name)
-
+    import mutagen.easymp4
+    _register_mp4_keys()
     afile = mutagen.easymp4.EasyMP4(path)
     afile.delete()  # Needed to remove tags not mapped by EasyMP4.
     afile.clear()
@@ -411,3 +486,158 @@ def write(path, tagset):
         _write_m4a(path, tagset)
     else:
         raise exceptions.FileTypeError('invalid file extension: ' + ext)
+
+    # Remove the cache entry, rather than read the file again; the file is read and cached on the
+    # next read, if any.
+    if _cache is not None:
+        _cache.delete(path)
+
+# --------------------------------------------------------------------------------------------------
+def _get_changed_tags(set_tags, remove_tags):
+    """
+    Return the set of lower-case cannonical names of the tags that are replaced or removed by an
+    update.
+    """
+    return set(_map_tag(tag, False).lower() for tag in list(set_tags.keys()) + list(remove_tags))
+
+# --------------------------------------------------------------------------------------------------
+def _update_vcomment(afile, write_map, set_tags, remove_tags):
+    """
+    Update the vcomment tags of an ogg vorbis, ogg opus, or flac file object.  Existing tags are
+    matched to the changed tags by case-folded cannonical name, in a single pass over the tags.
+    """
+    if afile.tags is None:
+        afile.add_tags()
+    changed = _get_changed_tags(set_tags, remove_tags)
+    afile.tags[:] = [(key, value) for key, value in afile.tags
+        if _map_tag(key, False).lower() not in changed]
+    for tag, values in set_tags.items():
+        key = write_map[tag] if tag in write_map else tag.lower()
+        afile.tags.extend((key, value) for value in values)
+    afile.save()
+
+# --------------------------------------------------------------------------------------------------
+def _get_frame_tags(frame, ftype):
+    """
+    Return the set of lower-case cannonical names of the tags held by an ID3 frame.
+    """
+    tags = set(item.tag.lower() for item in _break_frame(frame, ftype, False))
+    if ftype.upper().startswith('TXXX:'):
+        tags.add(_map_tag(ftype.partition(':')[2], False).lower())
+    return tags
+
+# --------------------------------------------------------------------------------------------------
+def _update_mp3(path, set_tags, remove_tags):
+    """
+    Update the tags of an mp3 file.  Existing frames are matched to the changed tags by case-folded
+    cannonical name.  A frame holding several tags (e.g., TIPL) that is only partly changed is
+    replaced by frames for the unchanged tags, as a full write would do.
+    """
+    import mutagen.id3
+    try:
+        afile = mutagen.id3.ID3(path)
+        afile.update_to_v24()
+    except mutagen.id3.ID3NoHeaderError:
+        afile = mutagen.id3.ID3()
+
+    changed = _get_changed_tags(set_tags, remove_tags)
+    kept = TagSet()
+    for ftype, frame in list(afile.items()):
+        if not _get_frame_tags(frame, ftype).isdisjoint(changed):
+            del afile[ftype]
+            for item in _break_frame(frame, ftype, False):
+                if item.tag.lower() not in changed:
+                    kept.append(item.tag, item.value)
+
+    for tagset in (kept, set_tags):
+        for tag, values in tagset.items():
+            for frame in _build_frames(tag, values):
+                afile.add(frame)
+    afile.save(path)
+
+# --------------------------------------------------------------------------------------------------
+def _get_mp4_atoms():
+    """
+    Return a map of the lower-case MP4 atom names to the EasyMP4 keys registered for them.  The atom
+    of each key is found by calling its EasyMP4 setter on an empty dictionary, so the map covers
+    both the native atoms and the freeform keys of tagmaps.mp4_map, just as EasyMP4 writes them.
+    """
+    import mutagen.easymp4
+    global _mp4_atoms
+    if _mp4_atoms is None:
+        _register_mp4_keys()
+        atoms = {}
+        for key, setter in mutagen.easymp4.EasyMP4Tags.Set.items():
+            probe = {}
+            setter(probe, key, ['1'])
+            atoms.update((atom.lower(), key) for atom in probe)
+        _mp4_atoms = atoms
+    return _mp4_atoms
+
+# --------------------------------------------------------------------------------------------------
+def _get_atom_tag(atom):
+    """
+    Return the lower-case cannonical name of the tag held by an MP4 atom, or None for an atom that
+    holds no tag (e.g., cover art).  Atom names are compared case-folded, and a freeform key stored
+    under an EasyMP4 key name (e.g., 'musicbrainz_trackid') is matched as well.
+    """
+    key = _get_mp4_atoms().get(atom.lower())
+    if key is None:
+        if not atom.lower().startswith(_mp4_freeform_prefix):
+            return None
+        key = atom[len(_mp4_freeform_prefix):]
+    return _map_tag(key, False).lower()
+
+# --------------------------------------------------------------------------------------------------
+def _update_m4a(path, set_tags, remove_tags):
+    """
+    Update the tags of an m4a file.  Existing atoms are matched to the changed tags by case-folded
+    cannonical name.  The file is opened with MP4 rather than EasyMP4, which only lists the atoms
+    stored under the exact names it registers, so that every variant of a changed tag is removed.
+    """
+    import mutagen.mp4
+    import mutagen.easymp4
+    afile = mutagen.mp4.MP4(path)
+    if afile.tags is None:
+        afile.add_tags()
+    changed = _get_changed_tags(set_tags, remove_tags)
+    for atom in [atom for atom in afile.tags.keys() if _get_atom_tag(atom) in changed]:
+        del afile.tags[atom]
+    setters = mutagen.easymp4.EasyMP4Tags.Set
+    for tag, values in set_tags.items():
+        key = tag.lower()
+        if key not in setters:
+            raise mutagen.easymp4.EasyMP4KeyError('%r is not a valid key' % key)
+        setters[key](afile.tags, key, values)
+    afile.save()
+
+# --------------------------------------------------------------------------------------------------
+def update(path, set_tags, remove_tags=()):
+    """
+    Update some of the tags of an audio file, leaving the others, including embedded images,
+    unchanged.  Each tag in the 'set_tags' TagSet replaces all existing values of the tag, and each
+    tag named in 'remove_tags' is removed.  Tag names are matched by cannonical name, regardless of
+    case or the variant stored in the file.  The file is opened and saved once.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.ogg':
+        import mutagen.oggvorbis
+        _update_vcomment(mutagen.oggvorbis.OggVorbis(path), tagmaps.vorbis_write_map, set_tags,
+            remove_tags)
+    elif ext == '.opus':
+        import mutagen.oggopus
+        _update_vcomment(mutagen.oggopus.OggOpus(path), tagmaps.opus_write_map, set_tags,
+            remove_tags)
+    elif ext == '.flac':
+        import mutagen.flac
+        _update_vcomment(mutagen.flac.FLAC(path), tagmaps.flac_write_map, set_tags, remove_tags)
+    elif ext == '.mp3':
+        _update_mp3(path, set_tags, remove_tags)
+    elif ext == '.m4a':
+        _update_m4a(path, set_tags, remove_tags)
+    else:
+        raise exceptions.FileTypeError('invalid file extension: ' + ext)
+
+    # Remove the cache entry, as for write.
+    if _cache is not None:
+        _cache.delete(path)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+# cachekan.py - kantag tool for maintaining the tag cache.
+# Copyright (C) 2018 David Gasaway
+# https://github.com/dgasaway/kantag
+
+# This program is free software; you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program; if not,
+# see <http://www.gnu.org/licenses>.
+from argparse import ArgumentParser
+from kantag import tagcache, mbcache
+from kantag._version import __version__
+
+# --------------------------------------------------------------------------------------------------
+def main():
+    """
+    Parse command line argument and initiate main operation.
+    """
+    parser = ArgumentParser(
+        description='Maintains the cache of tags read from audio files by the kantag tools.')
+    parser.add_argument('--version', action='version', version='%(prog)s ' + __version__)
+    parser.add_argument('-v', '--verbose',
+        help='verbose output',
+        action='count', default=0)
+    parser.add_argument('--cache-file',
+        help='cache database file [default=' + tagcache.default_path() + ']',
+        metavar='FILE', action='store', default=None)
+    parser.add_argument('-m', '--musicbrainz',
+        help='maintain the cache of musicbrainz web service responses [default cache file=' +
+        mbcache.default_path() + '] instead of the tag cache',
+        action='store_true', default=False)
+
+    subparsers = parser.add_subparsers(title='commands', dest='command', metavar='command')
+    subparsers.required = True
+    subparsers.add_parser('prune',
+        help='remove entries for files that are missing or have changed, or expired musicbrainz '
+        'responses')
+    subparsers.add_parser('clear',
+        help='remove all entries')
+
+    args = parser.parse_args()
+
+    if args.musicbrainz:
+        cache = mbcache.open_cache(args.cache_file)
+    else:
+        cache = tagcache.open_cache(args.cache_file)
+    if cache is None:
+        exit(2)
+
+    if args.command == 'prune':
+        count = cache.prune()
+    else:
+        count = cache.clear()
+    cache.close()
+
+    if args.verbose >= 1:
+        print('{0} entries removed from {1}'.format(count, cache.path))
+
+# --------------------------------------------------------------------------------------------------
+if __name__ == "__main__":
+    #main(sys.argv[1:])
+    main()
@@ -17,3 +17,13 @@ class ProgramCallError(TaggingError): pass
 class FileTypeError(TaggingError): pass
 class FilenameError(TaggingError): pass
 class TagFileFormatError(TaggingError): pass
+class MusicbrainzError(TaggingError): pass
+
+class TrackNumberError(TaggingError):
+    """
+    Raised for a disc or track number that is not numeric where it must be, e.g., to be condensed
+    into a range with other numbers.
+    """
+    def __init__(self, number):
+        TaggingError.__init__(self, 'invalid disc/track number: ' + number)
+        self.number = number
@@ -23,10 +23,12 @@ import re
 import argparse
 import importlib.util
 from argparse import ArgumentParser
-from kantag.util import ToggleAction, expand_globs
-from kantag.exceptions import TaggingError
+from pathlib import Path
+from kantag.util import ToggleAction, expand_globs, get_supported_audio_files
+from kantag.exceptions import TaggingError, TrackNumberError
 from kantag._version import __version__
 from kantag.tagfile import TagFileBuilder
+from kantag import audiofile, tagcache, mbcache
 from kantag.tagstores import Release, Disc, Track, ReleaseBuilder
 
 # Lists of initkan supported tags.
@@ -59,14 +61,44 @@ _replaygain_tags = [
     'replaygain_album_peak', 'replaygain_album_gain', 'replaygain_track_peak',
     'replaygain_track_gain'
     ]
+""" Name of the tag file written to each folder in recursive mode. """
+_library_tag_file = 'tags.kan'
 
 # --------------------------------------------------------------------------------------------------
 def main():
     """
     Parse command line argument and initiate main operation.
     """
-    # Parse the command line arguments.
-    parser = ArgumentParser(
+    global args
+    args = parse_args()
+
+    if args.cache:
+        audiofile.set_cache(tagcache.open_cache(warn=args.warn))
+    if args.call_musicbrainz and args.mb_cache:
+        from kantag import musicbrainz
+        cache = mbcache.open_cache(ttl_days=args.mb_cache_ttl, warn=args.warn)
+        if cache is None and args.offline:
+            print('error: the musicbrainz cache is required for offline mode', file=sys.stderr)
+            exit(2)
+        musicbrainz.set_cache(cache, args.offline)
+
+    # Write the output.
+    try:
+        if args.recursive:
+            process_library()
+        else:
+            process_files()
+    except TaggingError as e:
+        print('An exception occurred:\n' + ';'.join(e.args), file=sys.stderr)
+        exit(2)
+
+# --------------------------------------------------------------------------------------------------
+def parse_args(argv=None, prog=None):
+    """
+    Parse and return the command line arguments, or the given list of arguments, in which case the
+    program name shown in messages should also be given.
+    """
+    parser = ArgumentParser(prog=prog,
         description='Outputs to STDOUT a tag defintion file based on tags in the source files, the '
         'current path, the filenames passed, and calls to the MusicBrainz service.')
     parser.add_argument('--version', action='version', version='%(prog)s ' + __version__)
@@ -79,8 +111,23 @@ def main():
     parser.add_argument('-W', '--disable-warnings',
         help='disable all warnings',
         action='store_false', dest='warn', default=True)
+    parser.add_argument('--no-cache',
+        help='do not use or update the tag cache',
+        action='store_false', dest='cache', default=True)
+    parser.add_argument('-j', '--jobs',
+        help='number of files to read concurrently [default=1]',
+        metavar='N', action='store', type=int, default=1)
+    parser.add_argument('-R', '--recursive',
+        help='treat the arguments as folders, and write a tag file named ' + _library_tag_file +
+        ' for the supported audio files in each folder found under them; folders that already '
+        'have a tag file are skipped',
+        action='store_true', default=False)
+    parser.add_argument('--force',
+        help='with --recursive, replace the existing tag file of a folder; folders with more than '
+        'one tag file are still skipped',
+        action='store_true', default=False)
     parser.add_argument('audio_files',
-        help='audio files (Ogg Vorbis, Ogg Opus, FLAC, MP3, M4A)',
+        help='audio files (Ogg Vorbis, Ogg Opus, FLAC, MP3, M4A); with --recursive, folders',
         action='store', metavar='audio_file', nargs='+')
 
     group = parser.add_argument_group(title='tag edit arguments')
@@ -122,6 +169,20 @@ def main():
     group.add_argument('--locale',
         help='artist alias locale to use for musicbrainz data [default=en]',
         action='store', type=str, default='en')
+    group.add_argument('--recurse-works',
+        help='follow musicbrainz "part of" relationships to parent works to find additional '
+        'artist relations, such as the composer of a multi-part work [default=n]',
+        action=ToggleAction, choices=['y', 'n'], default=False)
+    group.add_argument('--no-mb-cache',
+        help='do not use or update the cache of musicbrainz web service responses',
+        action='store_false', dest='mb_cache', default=True)
+    group.add_argument('--mb-cache-ttl',
+        help='number of days a cached musicbrainz response is used [default=' +
+        str(mbcache.default_ttl_days) + ']',
+        metavar='DAYS', action='store', type=int, default=mbcache.default_ttl_days)
+    group.add_argument('--offline',
+        help='only use cached musicbrainz responses, without calling the web service',
+        action='store_true', default=False)
     group.add_argument('-A', '--ascii-punctuation',
         help='replace non-ascii punctuation in titles with ascii equivalents [default=y]',
         action=ToggleAction, choices=['y', 'n'], default=True)
@@ -166,28 +227,38 @@ def main():
         action=ToggleAction, choices=['y', 'n'], default=False)
 
     parser.set_defaults(keep_common=False)
-    global args
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     if args.verbose >= 2:
         print('<Arguments>', file=sys.stderr)
         print(pprint.PrettyPrinter(indent=2).pformat(vars(args)) + '\n', file=sys.stderr)
 
+    if args.jobs < 1:
+        parser.error('number of jobs must be at least 1')
+
     # Check for presence of musicbrainsngs.
     if args.call_musicbrainz == True:
         if importlib.util.find_spec('musicbrainzngs') is None:
             parser.error("musicbrainzngs package must be installed to use '--call-musicbrainz'")
+    if args.offline and not args.mb_cache:
+        parser.error("'--offline' may not be used with '--no-mb-cache'")
         
     # Expand any glob patterns left by the shell.
     args.audio_files = expand_globs(args.audio_files)
     if (len(args.audio_files) == 0):
         parser.error('no matching audio files found')
 
-    # Write the output.
-    try:
-        process_files()
-    except TaggingError as e:
-        print('An exception occurred:\n' + ';'.join(e.args), file=sys.stderr)
-        exit(2)
+    if args.recursive:
+        for folder in args.audio_files:
+            if not folder.is_dir():
+                parser.error('folder not found: ' + str(folder))
+        if args.output != '-':
+            parser.error('an output file may not be given with --recursive')
+        if args.release_mbid is not None:
+            parser.error('a release id may not be given with --recursive')
+    elif args.force:
+        parser.error('--force may only be given with --recursive')
+
+    return args
 
 # --------------------------------------------------------------------------------------------------
 def path_parts_regex():
@@ -555,13 +626,13 @@ def add_unstructured(builder, rel):
             add_tagset(builder, track, disc)
 
 # --------------------------------------------------------------------------------------------------
-def process_files():
+def build_tag_file(audio_files):
     """
-    Generate kantag format output for the selected files.
+    Return a TagFileBuilder containing kantag format output for the given files.
     """
     # Get a Release object containing tags for all the files.
     rel_builder = ReleaseBuilder(args)
-    rel_builder.read(args.audio_files)
+    rel_builder.read(audio_files)
     rel = rel_builder.release
 
     # Create a TagFileBuilder object to store the output.  Warnings are disabled because the user
@@ -569,18 +640,47 @@ def process_files():
     # the tag gets written out.
     builder = TagFileBuilder(warn=False)
 
-    if args.structured:
-        if args.standard:
-            add_structured(builder, rel)
-        if args.musicbrainz:
-            builder.add_blank()
-            add_musicbrainz(builder, rel)
-        if args.replaygain:
-            builder.add_blank()
-            add_replaygain(builder, rel)
-    else:
-        add_unstructured(builder, rel)
+    try:
+        if args.structured:
+            if args.standard:
+                add_structured(builder, rel)
+            if args.musicbrainz:
+                builder.add_blank()
+                add_musicbrainz(builder, rel)
+            if args.replaygain:
+                builder.add_blank()
+                add_replaygain(builder, rel)
+        else:
+            add_unstructured(builder, rel)
+    except TrackNumberError as e:
+        # The builder only sees the tags, so name the files here.
+        files = get_files_with_number(audio_files, e.number)
+        raise TaggingError('{0}: {1}'.format(', '.join(files), ';'.join(e.args)))
     builder.add_blank()
+    return builder
+
+# --------------------------------------------------------------------------------------------------
+def get_files_with_number(audio_files, number):
+    """
+    Return the names of the audio files with a disc number, track number, or disc and track number,
+    as written to a tag file, equal to a given number.
+    """
+    result = []
+    for filename in audio_files:
+        tags = audiofile.read(str(filename), False)
+        # Either number may be absent from the written number, e.g., on a disc line.
+        discs = tags.get('DiscNumber', []) + ['']
+        tracks = [track.zfill(2) for track in tags.get('TrackNumber', [])] + ['']
+        if any(disc + track == number for disc in discs for track in tracks):
+            result.append(str(filename))
+    return result
+
+# --------------------------------------------------------------------------------------------------
+def process_files():
+    """
+    Generate kantag format output for the selected files.
+    """
+    builder = build_tag_file(args.audio_files)
 
     # Write out from the builder.
     if args.output == '-':
@@ -589,6 +689,63 @@ def process_files():
         with io.open(args.output, mode='wt', encoding='utf-8') as f:
             f.write(str(builder.tags))
 
+# --------------------------------------------------------------------------------------------------
+def is_up_to_date(tag_files, audio_files):
+    """
+    Return whether any of the given tag files is newer than all the given audio files.
+    """
+    newest_audio = max(f.stat().st_mtime for f in audio_files)
+    return any(f.stat().st_mtime > newest_audio for f in tag_files)
+
+# --------------------------------------------------------------------------------------------------
+def process_library():
+    """
+    Generate a kantag file for the supported audio files in each folder under the selected folders.
+    Folders are processed one at a time, so only a single release is held in memory.  An error in
+    one folder is reported, and does not prevent processing of the others.  A folder that already
+    has a tag file is skipped, since the file may have been edited, and its audio files are newer
+    than it once it has been applied.  With --force, a single existing tag file is replaced, rather
+    than a second one being written beside it.
+    """
+    failed = 0
+    for root in args.audio_files:
+        for dirpath, dirnames, filenames in os.walk(root):
+            # Sort in place so that os.walk visits the subfolders in order.
+            dirnames.sort()
+            folder = Path(dirpath)
+            audio_files = get_supported_audio_files(folder)
+            if len(audio_files) == 0:
+                continue
+            tag_files = sorted(folder.glob('*.kan'))
+            if len(tag_files) > 0 and not args.force:
+                if is_up_to_date(tag_files, audio_files):
+                    if args.verbose >= 1:
+                        print('{0}: up to date'.format(folder))
+                elif args.warn:
+                    print('warning: {0}: tag file exists; use --force to replace it'.format(
+                        ', '.join(str(f) for f in tag_files)), file=sys.stderr)
+                continue
+            if len(tag_files) > 1:
+                if args.warn:
+                    print('warning: {0}: more than one tag file; folder skipped'.format(folder),
+                        file=sys.stderr)
+                continue
+
+            try:
+                builder = build_tag_file(audio_files)
+            except TaggingError as e:
+                print('error: {0}: {1}'.format(folder, ';'.join(e.args)), file=sys.stderr)
+                failed += 1
+                continue
+
+            output = tag_files[0] if len(tag_files) > 0 else folder / _library_tag_file
+            with io.open(output, mode='wt', encoding='utf-8') as f:
+                f.write(str(builder.tags))
+            print('{0}: written'.format(output))
+
+    if failed > 0:
+        raise TaggingError('failed to generate tag files for {0} folders'.format(failed))
+
 # --------------------------------------------------------------------------------------------------
 if __name__ == "__main__":
     #main(sys.argv[1:])
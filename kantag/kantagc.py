@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+# kantagc.py - kantag client for the kantagd daemon.
+# Copyright (C) 2018 David Gasaway
+# https://github.com/dgasaway/kantag
+
+# This program is free software; you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program; if not,
+# see <http://www.gnu.org/licenses>.
+import sys
+import os
+import json
+import socket
+import argparse
+from argparse import ArgumentParser
+from kantag._version import __version__
+
+# Only the standard library is imported here, so the client starts quickly; the work is done by the
+# daemon, which has the audio file modules and caches loaded already.
+
+# --------------------------------------------------------------------------------------------------
+def default_socket_path():
+    """
+    Return the default location of the kantagd socket, which is in the user runtime folder, if
+    there is one, or else the user cache folder.
+    """
+    base = os.environ.get('XDG_RUNTIME_DIR')
+    if not base:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        base = os.path.join(base, 'kantag')
+    return os.path.join(base, 'kantagd.sock')
+
+# --------------------------------------------------------------------------------------------------
+def request(req, path=None):
+    """
+    Send a request, a dictionary with an 'op' and the operation arguments, to the daemon listening
+    on the given or default socket, and return the response dictionary.  Relative paths in the
+    request are resolved against the current folder of the caller.
+    """
+    req = dict(req)
+    req.setdefault('cwd', os.getcwd())
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path if path is not None else default_socket_path())
+        with sock.makefile('rwb') as f:
+            f.write(json.dumps(req).encode('utf-8') + b'\n')
+            f.flush()
+            line = f.readline()
+    if not line:
+        raise ConnectionError('kantagd closed the connection without a response')
+    return json.loads(line.decode('utf-8'))
+
+# --------------------------------------------------------------------------------------------------
+def main():
+    """
+    Parse command line argument and initiate main operation.
+    """
+    parser = ArgumentParser(
+        description='Sends a request to the kantagd daemon, and outputs the result as the '
+        'corresponding kantag tool would.')
+    parser.add_argument('--version', action='version', version='%(prog)s ' + __version__)
+    parser.add_argument('-s', '--socket',
+        help='daemon socket [default=' + default_socket_path() + ']',
+        metavar='PATH', action='store', default=None)
+    parser.add_argument('command',
+        help='read_raw, to output the tags in audio files, as showkan; apply, to apply a tag file '
+        'to audio files, as applykan; or generate, to generate a tag file from audio files, as '
+        'initkan',
+        choices=['read_raw', 'apply', 'generate'])
+    parser.add_argument('arguments',
+        help='the audio files for read_raw, optionally preceded by -W to disable warnings; '
+        'otherwise, the applykan or initkan arguments',
+        nargs=argparse.REMAINDER)
+
+    args = parser.parse_args()
+
+    if args.command == 'read_raw':
+        files = [f for f in args.arguments if f not in ('-W', '--no-warn')]
+        req = {'op': 'read_raw', 'files': files, 'warn': len(files) == len(args.arguments)}
+    else:
+        req = {'op': args.command, 'args': args.arguments}
+
+    try:
+        resp = request(req, args.socket)
+    except (OSError, ValueError) as e:
+        print('error: unable to contact kantagd: ' + str(e), file=sys.stderr)
+        exit(2)
+
+    if args.command == 'read_raw' and resp.get('result') is not None:
+        for filename, tags in resp['result']:
+            print(filename)
+            for tag, value in sorted(tags, key=lambda item: item[0]):
+                print('\t{0:30} = {1}'.format(tag, value))
+    sys.stdout.write(resp.get('stdout', ''))
+    sys.stderr.write(resp.get('stderr', ''))
+    exit(resp.get('status', 0))
+
+# --------------------------------------------------------------------------------------------------
+if __name__ == "__main__":
+    #main(sys.argv[1:])
+    main()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+
+# kantagd.py - kantag daemon serving tool requests over a local socket.
+# Copyright (C) 2018 David Gasaway
+# https://github.com/dgasaway/kantag
+
+# This program is free software; you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program; if not,
+# see <http://www.gnu.org/licenses>.
+import sys
+import os
+import io
+import json
+import time
+import signal
+import socket
+import socketserver
+import contextlib
+import traceback
+import pprint
+from argparse import ArgumentParser
+from kantag.exceptions import TaggingError
+from kantag import audiofile, tagcache, mbcache, initkan, applykan
+from kantag.kantagc import default_socket_path
+from kantag._version import __version__
+
+# --------------------------------------------------------------------------------------------------
+def main():
+    """
+    Parse command line argument and initiate main operation.
+    """
+    parser = ArgumentParser(
+        description='Serves read, apply, and generate requests from kantagc, or another client, '
+        'over a Unix domain socket, keeping the tag cache and musicbrainz cache open between '
+        'requests.')
+    parser.add_argument('--version', action='version', version='%(prog)s ' + __version__)
+    parser.add_argument('-v', '--verbose',
+        help='log each request to STDERR',
+        action='count', default=0)
+    parser.add_argument('-s', '--socket',
+        help='socket to listen on [default=' + default_socket_path() + ']',
+        metavar='PATH', action='store', default=default_socket_path())
+    parser.add_argument('--no-cache',
+        help='do not use or update the tag cache',
+        action='store_false', dest='cache', default=True)
+    parser.add_argument('--no-mb-cache',
+        help='do not use or update the cache of musicbrainz web service responses',
+        action='store_false', dest='mb_cache', default=True)
+
+    args = parser.parse_args()
+    if args.verbose >= 2:
+        print('<Arguments>', file=sys.stderr)
+        print(pprint.PrettyPrinter(indent=2).pformat(vars(args)) + '\n', file=sys.stderr)
+
+    try:
+        server = Server(args)
+    except (TaggingError, OSError) as e:
+        print('error: unable to listen on {0}: {1}'.format(args.socket, e), file=sys.stderr)
+        exit(2)
+
+    # Exit through the finally clause on SIGTERM, so the socket is removed.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        if args.verbose >= 1:
+            print('listening on ' + args.socket, file=sys.stderr)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+# --------------------------------------------------------------------------------------------------
+class RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Handles a connection to the daemon, which carries one JSON request per line, each answered
+    with one JSON response line.
+    """
+    def handle(self):
+        for line in self.rfile:
+            if line.strip() == b'':
+                continue
+            start = time.monotonic()
+            req = {}
+            try:
+                req = json.loads(line.decode('utf-8'))
+                if not isinstance(req, dict):
+                    raise ValueError('request must be an object')
+            except ValueError as e:
+                resp = {'status': 2, 'stderr': 'error: invalid request: ' + str(e) + '\n'}
+            else:
+                resp = self.server.handle_json(req)
+            self.wfile.write(json.dumps(resp).encode('utf-8') + b'\n')
+            self.wfile.flush()
+            if self.server.args.verbose >= 1:
+                print('{0}: status {1} ({2:.0f} ms)'.format(req.get('op'), resp.get('status'),
+                    (time.monotonic() - start) * 1000), file=sys.stderr, flush=True)
+
+# --------------------------------------------------------------------------------------------------
+class Server(socketserver.UnixStreamServer):
+    """
+    Unix domain socket server for kantag requests.  Requests are handled one at a time, because the
+    tools keep their options in module globals and write to STDOUT and STDERR, which are captured
+    for each request.
+
+    A request is an object with an 'op' and 'cwd', the folder against which relative paths are
+    resolved, plus:
+
+    - read_raw: 'files', a list of audio files, and optionally 'warn'.
+    - apply: 'args', a list of applykan arguments.
+    - generate: 'args', a list of initkan arguments.
+
+    A response is an object with 'status', the exit status of the corresponding tool, 'stdout' and
+    'stderr', the tool output, and, for read_raw, 'result', a list of [file, [[tag, value], ...]].
+    """
+    def __init__(self, args):
+        self.args = args
+        self._tag_cache = None
+        self._mb_caches = {}
+        self._remove_stale_socket(args.socket)
+        os.makedirs(os.path.dirname(os.path.abspath(args.socket)), exist_ok=True)
+        super().__init__(args.socket, RequestHandler)
+        os.chmod(args.socket, 0o600)
+        self._tag_cache = tagcache.open_cache() if args.cache else None
+
+    # ----------------------------------------------------------------------------------------------
+    @staticmethod
+    def _remove_stale_socket(path):
+        """
+        Remove a socket left by a daemon that did not exit cleanly.  An error is raised if another
+        daemon is listening on the socket.
+        """
+        if not os.path.exists(path):
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(path)
+            except OSError:
+                os.remove(path)
+                return
+        raise TaggingError('another daemon is listening on ' + path)
+
+    # ----------------------------------------------------------------------------------------------
+    def server_close(self):
+        super().server_close()
+        with contextlib.suppress(OSError):
+            os.remove(self.args.socket)
+        if self._tag_cache is not None:
+            self._tag_cache.close()
+        for cache in self._mb_caches.values():
+            if cache is not None:
+                cache.close()
+
+    # ----------------------------------------------------------------------------------------------
+    def _get_mb_cache(self, ttl_days, warn):
+        """
+        Return the musicbrainz cache for a TTL, which is opened on first use.
+        """
+        if ttl_days not in self._mb_caches:
+            self._mb_caches[ttl_days] = mbcache.open_cache(ttl_days=ttl_days, warn=warn)
+        return self._mb_caches[ttl_days]
+
+    # ----------------------------------------------------------------------------------------------
+    def handle_json(self, req):
+        """
+        Perform a request, and return the response.
+        """
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        resp = {'status': 0}
+        try:
+            os.chdir(req.get('cwd', '/'))
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                op = req.get('op')
+                if op == 'read_raw':
+                    resp['result'] = self._read_raw(req.get('files', []), req.get('warn', True))
+                elif op == 'apply':
+                    self._apply(req.get('args', []))
+                elif op == 'generate':
+                    self._generate(req.get('args', []))
+                else:
+                    raise TaggingError('unknown operation: ' + str(op))
+        except SystemExit as e:
+            # Raised by argument errors, --help, and --version.
+            resp['status'] = e.code if isinstance(e.code, int) else 2
+        except TaggingError as e:
+            print('An exception occurred:\n' + ';'.join(e.args), file=stderr)
+            resp['status'] = 2
+        except OSError as e:
+            print('error: ' + str(e), file=stderr)
+            resp['status'] = 2
+        except Exception as e:
+            # Keep serving after an unexpected error, but record it.
+            traceback.print_exc()
+            print('error: ' + str(e), file=stderr)
+            resp['status'] = 1
+        resp['stdout'] = stdout.getvalue()
+        resp['stderr'] = stderr.getvalue()
+        return resp
+
+    # ----------------------------------------------------------------------------------------------
+    def _read_raw(self, files, warn):
+        """
+        Read the tags from audio files, as showkan.
+        """
+        audiofile.set_cache(self._tag_cache)
+        return [[filename, [list(item) for item in audiofile.read_raw(filename, warn)]]
+            for filename in files]
+
+    # ----------------------------------------------------------------------------------------------
+    def _apply(self, argv):
+        """
+        Apply a tag file to audio files, as applykan.
+        """
+        args = applykan.parse_args(argv, 'applykan')
+        if args.tag_file == '-':
+            raise TaggingError('STDIN may not be used as the tag file')
+        if args.watch:
+            raise TaggingError('--watch is not supported')
+        audiofile.set_cache(self._tag_cache if args.cache else None)
+        applykan.process_files(args)
+
+    # ----------------------------------------------------------------------------------------------
+    def _generate(self, argv):
+        """
+        Generate a tag file from audio files, as initkan.
+        """
+        args = initkan.parse_args(argv, 'initkan')
+        audiofile.set_cache(self._tag_cache if args.cache else None)
+        if args.call_musicbrainz:
+            from kantag import musicbrainz
+            cache = None
+            if args.mb_cache and self.args.mb_cache:
+                cache = self._get_mb_cache(args.mb_cache_ttl, args.warn)
+            if cache is None and args.offline:
+                raise TaggingError('the musicbrainz cache is required for offline mode')
+            musicbrainz.set_cache(cache, args.offline)
+        initkan.args = args
+        try:
+            if args.recursive:
+                initkan.process_library()
+            else:
+                initkan.process_files()
+        finally:
+            # Prefetched responses are only kept for the request, and only the cache applies a TTL.
+            if args.call_musicbrainz:
+                musicbrainz.clear_prefetched()
+
+# --------------------------------------------------------------------------------------------------
+if __name__ == "__main__":
+    #main(sys.argv[1:])
+    main()
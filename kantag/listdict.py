@@ -12,11 +12,85 @@
 #
 # You should have received a copy of the GNU General Public License along with this program; if not,
 # see <http://www.gnu.org/licenses>.
+""" Length above which a list gets a companion set of its values for membership checks. """
+_set_threshold = 8
+""" Unbound dict.__setitem__, for storing a list without replacing its companion set. """
+_dict_setitem = dict.__setitem__
+
 class ListDict(dict):
     """
     Data container that extends dict with convenience methods for storing a list with each
-    dictionary slot.
+    dictionary slot.  A list longer than a few values also gets a companion set of its values, so
+    that membership checks by the methods are constant time rather than a scan of the list.  The
+    values must therefore be hashable, and a list must not be modified in place except through the
+    methods; assign a new list to the key instead.
     """
+    __slots__ = ('_sets',)
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self)
+        self._sets = {}
+        if args or kwargs:
+            self.update(*args, **kwargs)
+
+    # ----------------------------------------------------------------------------------------------
+    def __reduce__(self):
+        # Rebuild through __setitem__ when copied or pickled, so the sets are rebuilt too.
+        return (self.__class__, (), None, None, iter(self.items()))
+
+    # ----------------------------------------------------------------------------------------------
+    def __setitem__(self, key, values):
+        _dict_setitem(self, key, values)
+        if len(values) > _set_threshold:
+            self._sets[key] = set(values)
+        else:
+            self._sets.pop(key, None)
+
+    # ----------------------------------------------------------------------------------------------
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._sets.pop(key, None)
+
+    # ----------------------------------------------------------------------------------------------
+    def pop(self, key, *args):
+        self._sets.pop(key, None)
+        return dict.pop(self, key, *args)
+
+    # ----------------------------------------------------------------------------------------------
+    def popitem(self):
+        item = dict.popitem(self)
+        self._sets.pop(item[0], None)
+        return item
+
+    # ----------------------------------------------------------------------------------------------
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default if default is not None else []
+        return dict.__getitem__(self, key)
+
+    # ----------------------------------------------------------------------------------------------
+    def update(self, *args, **kwargs):
+        for key, values in dict(*args, **kwargs).items():
+            self[key] = values
+
+    # ----------------------------------------------------------------------------------------------
+    def clear(self):
+        dict.clear(self)
+        self._sets.clear()
+
+    # ----------------------------------------------------------------------------------------------
+    def _append_new(self, key, l, value):
+        """
+        Append a value known not to be in the list at the key, and add it to the companion set, or
+        create the set if the list has grown long enough to need one.
+        """
+        l.append(value)
+        found = self._sets.get(key)
+        if found is not None:
+            found.add(value)
+        elif len(l) > _set_threshold:
+            self._sets[key] = set(l)
+
     # ----------------------------------------------------------------------------------------------
     @staticmethod
     def _list_diff(a, b):
@@ -78,24 +152,24 @@ class ListDict(dict):
         """
         Append a value to the list at the key.
         """
-        if key in self:
-            self[key].append(value)
-        else:
+        l = self.get(key)
+        if l is None:
             # Create a new sequence at the key.
-            self[key] = [value]
+            _dict_setitem(self, key, [value])
+        else:
+            self._append_new(key, l, value)
 
     # ----------------------------------------------------------------------------------------------
     def append_unique(self, key, value):
         """
         Append a value to the list at they key, provided the value is not already in the list.
         """
-        if key in self:
-            l = self[key]
-            if value not in l:
-                l.append(value)
-        else:
+        l = self.get(key)
+        if l is None:
             # Create a new sequence at the key.
-            self[key] = [value]
+            _dict_setitem(self, key, [value])
+        elif value not in self._sets.get(key, l):
+            self._append_new(key, l, value)
 
     # ----------------------------------------------------------------------------------------------
     def extend(self, key, values):
@@ -126,9 +200,14 @@ class ListDict(dict):
         """
         Replace matching values in the list at the key.
         """
-        if key in self:
+        l = self.get(key)
+        if l is not None and replace in self._sets.get(key, l):
             #self[key] = map((lambda v: replacement if v == replace else v), self[key])
-            ListDict._list_replace(self[key], replace, replacement)
+            ListDict._list_replace(l, replace, replacement)
+            found = self._sets.get(key)
+            if found is not None:
+                found.discard(replace)
+                found.add(replacement)
 
     # ----------------------------------------------------------------------------------------------
     def replace_ci(self, key, replace, replacement):
@@ -137,7 +216,8 @@ class ListDict(dict):
         """
         if key in self:
             #self[key] = map((lambda v: replacement if v == replace else v), self[key])
-            ListDict._list_replace_ci(self[key], replace, replacement)
+            if ListDict._list_replace_ci(self[key], replace, replacement) and key in self._sets:
+                self._sets[key] = set(self[key])
 
     # ----------------------------------------------------------------------------------------------
     def remove(self, key, value):
@@ -145,7 +225,7 @@ class ListDict(dict):
         Remove a value from the list at key; if the list is empty after removing the value, remove
         the key.
         """
-        if key in self:
+        if key in self and value in self._sets.get(key, self[key]):
             l = [v for v in self[key] if v != value]
             if len(l) == 0:
                 del self[key]
@@ -160,14 +240,23 @@ class ListDict(dict):
         """
         # Note we want this code to preserve the order of the items in the list.  That's why we use
         # a replace when possible rather than a simpler remove/append.
-        if key in self:
-            l = self[key]
+        l = self.get(key)
+        if l is None:
+            _dict_setitem(self, key, [value])
+            return
+        found = self._sets.get(key)
+        if found is None:
             replaced = ListDict._list_replace(l, replace, value)
             # As an optimization, avoid attempting to append if there was a replace.
             if not replaced and value not in l:
-                l.append(value)
-        else:
-            self[key] = [value]
+                self._append_new(key, l, value)
+        elif replace in found:
+            # The set tells whether there is anything to replace without a scan of the list.
+            ListDict._list_replace(l, replace, value)
+            found.discard(replace)
+            found.add(value)
+        elif value not in found:
+            self._append_new(key, l, value)
 
     # ----------------------------------------------------------------------------------------------
     def remove_dict(self, remove):
@@ -185,7 +274,12 @@ class ListDict(dict):
         remove key a.
         """
         if a in self:
-            self[b] = self[a]
+            l = self[a]
+            found = self._sets.get(a)
+            self.pop(b, None)
+            _dict_setitem(self, b, l)
+            if found is not None:
+                self._sets[b] = found
             del self[a]
 
     # ----------------------------------------------------------------------------------------------
@@ -193,7 +287,7 @@ class ListDict(dict):
         """
         Return whether the list at the given key contains the given value.
         """
-        return key in self and value in self[key]
+        return key in self and value in self._sets.get(key, self[key])
 
     # ----------------------------------------------------------------------------------------------
     def apply_to_all(self, key, func):
@@ -0,0 +1,120 @@
+# manifest.py - kantag record of the tags last applied from a tag file.
+# Copyright (C) 2018 David Gasaway
+# https://github.com/dgasaway/kantag
+
+# This program is free software; you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program; if not,
+# see <http://www.gnu.org/licenses>.
+import os
+import io
+import json
+import hashlib
+import threading
+from ._version import __version__
+
+# Globals
+""" Suffix appended to the name of a tag file to get the name of its manifest. """
+manifest_suffix = '.manifest'
+
+# --------------------------------------------------------------------------------------------------
+def get_manifest_path(tag_file):
+    """
+    Return the path of the manifest for a tag file, which is stored next to the tag file.
+    """
+    return str(tag_file) + manifest_suffix
+
+# --------------------------------------------------------------------------------------------------
+def hash_tags(tagset):
+    """
+    Return a content hash of a TagSet.  The order of tags and values is significant, as it is when
+    the tags are written.
+    """
+    data = json.dumps(list(tagset.items()), ensure_ascii=False)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+# --------------------------------------------------------------------------------------------------
+class Manifest(object):
+    """
+    Record of the tags last applied from a tag file to each audio file, as a hash of the TagSet and
+    the size and modification time of the audio file after it was written.  A file need not be
+    written again if neither the tags nor the file have changed since.  Instances may be shared
+    between threads.
+    """
+    def __init__(self, path):
+        self._path = path
+        self._files = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    # ----------------------------------------------------------------------------------------------
+    @property
+    def path(self):
+        """Path of the manifest file."""
+        return self._path
+
+    # ----------------------------------------------------------------------------------------------
+    def _load(self):
+        """
+        Load the manifest file, if it exists.  A manifest that cannot be read, or was written by
+        another version of kantag, is ignored.
+        """
+        try:
+            with io.open(self._path, mode='rt', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if isinstance(data, dict) and data.get('version') == __version__:
+            self._files = data.get('files', {})
+
+    # ----------------------------------------------------------------------------------------------
+    def _get_key(self, filename):
+        """
+        Return the key for an audio file, which is the path relative to the manifest folder.
+        """
+        folder = os.path.dirname(os.path.abspath(self._path))
+        return os.path.relpath(os.path.abspath(str(filename)), folder)
+
+    # ----------------------------------------------------------------------------------------------
+    def is_current(self, filename, tagset):
+        """
+        Return whether the TagSet is the one last applied to the audio file, and the file has not
+        been modified since.
+        """
+        with self._lock:
+            entry = self._files.get(self._get_key(filename))
+        if entry is None or entry['hash'] != hash_tags(tagset):
+            return False
+        try:
+            st = os.stat(str(filename))
+        except OSError:
+            return False
+        return entry['size'] == st.st_size and entry['mtime'] == st.st_mtime_ns
+
+    # ----------------------------------------------------------------------------------------------
+    def update(self, filename, tagset):
+        """
+        Record that the TagSet was applied to the audio file, as it is now.
+        """
+        st = os.stat(str(filename))
+        entry = {'hash': hash_tags(tagset), 'size': st.st_size, 'mtime': st.st_mtime_ns}
+        with self._lock:
+            self._files[self._get_key(filename)] = entry
+
+    # ----------------------------------------------------------------------------------------------
+    def save(self):
+        """
+        Write the manifest file.
+        """
+        with self._lock:
+            data = {'version': __version__, 'files': self._files}
+        tmp_path = self._path + '.tmp'
+        with io.open(tmp_path, mode='wt', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp_path, self._path)
@@ -0,0 +1,171 @@
+# mbcache.py - kantag persistent cache of musicbrainz web service responses.
+# Copyright (C) 2018 David Gasaway
+# https://github.com/dgasaway/kantag
+
+# This program is free software; you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program; if not,
+# see <http://www.gnu.org/licenses>.
+import sys
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# Globals
+""" Default number of days a response is used before it is fetched again. """
+default_ttl_days = 30
+""" Default maximum total size, in bytes, of the stored responses. """
+default_max_size = 200 * 1024 * 1024
+
+# --------------------------------------------------------------------------------------------------
+def default_path():
+    """
+    Return the default location of the cache database, which is in the user cache folder.
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'kantag', 'musicbrainz.sqlite')
+
+# --------------------------------------------------------------------------------------------------
+def _get_includes_key(includes):
+    """
+    Return a string identifying a list of musicbrainz includes, independent of order.
+    """
+    return ','.join(sorted(includes))
+
+# --------------------------------------------------------------------------------------------------
+class ResponseCache(object):
+    """
+    Persistent cache of the responses returned by the musicbrainz web service, stored in an SQLite
+    database.  Entries are keyed by entity type, MBID, and include list.  An entry older than the
+    TTL is not used, except in offline mode, and when the total size of the entries exceeds the
+    maximum size, the least recently used entries are evicted.  Instances may be shared between
+    threads.
+    """
+    def __init__(self, path=None, ttl_days=default_ttl_days, max_size=default_max_size):
+        self._path = path if path is not None else default_path()
+        self._ttl = ttl_days * 24 * 60 * 60
+        self._max_size = max_size
+        os.makedirs(os.path.dirname(os.path.abspath(self._path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self._path, timeout=30, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS responses (entity TEXT, mbid TEXT, includes TEXT, '
+            'fetched REAL, accessed REAL, size INTEGER, data TEXT, '
+            'PRIMARY KEY (entity, mbid, includes))')
+        self._db.execute(
+            'CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self._db.commit()
+
+    # ----------------------------------------------------------------------------------------------
+    @property
+    def path(self):
+        """Path of the cache database."""
+        return self._path
+
+    # ----------------------------------------------------------------------------------------------
+    def get(self, entity, mbid, includes, allow_expired=False):
+        """
+        Return the cached response for an entity type (e.g., 'release'), MBID, and list of includes,
+        or None if there is no entry.  An expired entry is only returned if 'allow_expired' is set.
+        """
+        key = (entity, mbid, _get_includes_key(includes))
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                'SELECT fetched, data FROM responses WHERE entity=? AND mbid=? AND includes=?',
+                key).fetchone()
+            if row is None or (not allow_expired and now - row[0] > self._ttl):
+                return None
+            self._db.execute(
+                'UPDATE responses SET accessed=? WHERE entity=? AND mbid=? AND includes=?',
+                (now,) + key)
+            self._db.commit()
+        return json.loads(row[1])
+
+    # ----------------------------------------------------------------------------------------------
+    def put(self, entity, mbid, includes, response):
+        """
+        Store a response, then evict the least recently used entries if the cache is too large.
+        """
+        data = json.dumps(response)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses '
+                '(entity, mbid, includes, fetched, accessed, size, data) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (entity, mbid, _get_includes_key(includes), now, now, len(data), data))
+            self._evict()
+            self._db.commit()
+
+    # ----------------------------------------------------------------------------------------------
+    def _evict(self):
+        """
+        Remove the least recently used entries until the total size is within the maximum.  The
+        caller must hold the lock.
+        """
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self._max_size:
+            return
+        stale = []
+        for rowid, size in self._db.execute(
+                'SELECT rowid, size FROM responses ORDER BY accessed'):
+            if total <= self._max_size:
+                break
+            stale.append((rowid,))
+            total -= size
+        self._db.executemany('DELETE FROM responses WHERE rowid=?', stale)
+
+    # ----------------------------------------------------------------------------------------------
+    def prune(self):
+        """
+        Remove the expired entries.  Returns the number of entries removed.
+        """
+        with self._lock:
+            count = self._db.execute(
+                'DELETE FROM responses WHERE fetched < ?', (time.time() - self._ttl,)).rowcount
+            self._db.commit()
+            self._db.execute('VACUUM')
+        return count
+
+    # ----------------------------------------------------------------------------------------------
+    def clear(self):
+        """
+        Remove all entries.  Returns the number of entries removed.
+        """
+        with self._lock:
+            count = self._db.execute('DELETE FROM responses').rowcount
+            self._db.commit()
+            self._db.execute('VACUUM')
+        return count
+
+    # ----------------------------------------------------------------------------------------------
+    def close(self):
+        """
+        Close the cache database.
+        """
+        with self._lock:
+            self._db.close()
+
+# --------------------------------------------------------------------------------------------------
+def open_cache(path=None, ttl_days=default_ttl_days, max_size=default_max_size, warn=True):
+    """
+    Open a ResponseCache at the given or default location.  If the cache cannot be opened, a warning
+    is displayed and None is returned.
+    """
+    try:
+        return ResponseCache(path, ttl_days, max_size)
+    except (OSError, sqlite3.Error) as e:
+        if warn:
+            print('warning: unable to open musicbrainz cache: ' + str(e), file=sys.stderr)
+        return None
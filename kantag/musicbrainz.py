@@ -16,7 +16,10 @@ import sys
 import pprint
 import collections
 import warnings
+import asyncio
+import functools
 import musicbrainzngs as ngs
+from kantag import exceptions
 from kantag._version import __version__
 
 # Globals
@@ -115,36 +118,217 @@ Relation = collections.namedtuple('Relation', 'type, name, sortname')
 """ An artist name-sortname pair. """
 ArtistName = collections.namedtuple('ArtistName', 'name, sortname')
 
+""" Musicbrainz API includes requested for each entity type. """
+_includes = {
+    'release': ['artists', 'artist-credits', 'artist-rels', 'recordings', 'recording-level-rels',
+        'work-rels', 'work-level-rels', 'release-groups', 'labels', 'aliases'],
+    'recording': ['artists', 'artist-rels', 'work-rels', 'aliases'],
+    'work': ['artist-rels', 'work-rels', 'aliases'],
+    }
+""" Optional ResponseCache used for web service responses. """
+_cache = None
+""" Whether responses are only served from the cache, without calling the web service. """
+_offline = False
+"""
+Responses of the latest prefetch when no cache is set, keyed by (entity type, MBID).  Only one batch
+is kept, so the memory held is bounded, and the responses are not served beyond the run that
+prefetched them.
+"""
+_prefetched = {}
+
 # Initialize the user agent.
 ngs.set_useragent('kantag', __version__, 'https://github.com/dgasaway/kantag')
 with warnings.catch_warnings():
     warnings.simplefilter('ignore')
     ngs.set_format('json')
 
+# --------------------------------------------------------------------------------------------------
+def set_cache(cache, offline=False):
+    """
+    Set a ResponseCache to be used for web service responses, or None to disable caching.  In
+    offline mode, responses are only served from the cache, including expired entries, and a
+    MusicbrainzError is raised for a response that is not in the cache.
+    """
+    global _cache, _offline
+    _cache = cache
+    _offline = offline
+    clear_prefetched()
+
+# --------------------------------------------------------------------------------------------------
+def clear_prefetched():
+    """
+    Discard the responses kept by a prefetch.
+    """
+    _prefetched.clear()
+
+# --------------------------------------------------------------------------------------------------
+def _get_cached(entity, mbid):
+    """
+    Return a prefetched or cached response for an entity, or None if there is none.
+    """
+    response = _prefetched.get((entity, mbid))
+    if response is None and _cache is not None:
+        response = _cache.get(entity, mbid, _includes[entity], _offline)
+    return response
+
+# --------------------------------------------------------------------------------------------------
+def _call_api(entity, mbid):
+    """
+    Call the musicbrainz API function for an entity type, and store the response in the cache.  The
+    function is looked up at call time, so a stand-in may be substituted.
+    """
+    func = getattr(ngs, 'get_{0}_by_id'.format(entity))
+    response = func(mbid, includes=_includes[entity])
+    if _cache is not None:
+        _cache.put(entity, mbid, _includes[entity], response)
+    return response
+
+# --------------------------------------------------------------------------------------------------
+def _fetch(entity, mbid):
+    """
+    Return the response for an entity from the prefetched responses or the cache, if available,
+    otherwise call the musicbrainz API.
+    """
+    response = _get_cached(entity, mbid)
+    if response is not None:
+        return response
+    if _offline:
+        raise exceptions.MusicbrainzError(
+            'offline mode: no cached musicbrainz {0} {1}'.format(entity, mbid))
+    return _call_api(entity, mbid)
+
 # --------------------------------------------------------------------------------------------------
 def get_release_by_id(releaseid):
     """
     Call the musicbrainz API and return the Release object matching the releaseid.
     """
-    incs = ['artists', 'artist-credits', 'artist-rels', 'recordings', 'recording-level-rels',
-            'work-rels', 'work-level-rels', 'release-groups', 'labels', 'aliases']
-    return ngs.get_release_by_id(releaseid, includes=incs)
+    return _fetch('release', releaseid)
 
 # --------------------------------------------------------------------------------------------------
 def get_recording_by_id(recordingid):
     """
     Call the musicbrainz API and return recording information, including artist and work ARs.
     """
-    incs = ['artists', 'artist-rels', 'work-rels', 'aliases']
-    return ngs.get_recording_by_id(recordingid, includes=incs)
+    return _fetch('recording', recordingid)
 
 # --------------------------------------------------------------------------------------------------
 def get_work_by_id(workid, include_work_rels=False):
     """
     Call the musicbrainz API and return work information, including artist ARs.
     """
-    incs = ['artist-rels', 'work-rels', 'aliases']
-    return ngs.get_work_by_id(workid, includes=incs)
+    return _fetch('work', workid)
+
+# --------------------------------------------------------------------------------------------------
+class TokenBucket(object):
+    """
+    Token bucket rate limiter for asyncio tasks.  Tokens are added at 'rate' per second, up to
+    'capacity', and each request takes one token, waiting if none is available.  Waiting tasks are
+    served in the order they called acquire().
+    """
+    def __init__(self, rate=1.0, capacity=1):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated = None
+        # Created on first use, so it belongs to the running event loop.
+        self._lock = None
+
+    # ----------------------------------------------------------------------------------------------
+    async def acquire(self):
+        """
+        Wait until a token is available, and take it.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                now = loop.time()
+                if self._updated is not None:
+                    elapsed = now - self._updated
+                    self._tokens = min(self._capacity, self._tokens + elapsed * self._rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+# --------------------------------------------------------------------------------------------------
+async def prefetch_async(releases=(), recordings=(), works=(), bucket=None):
+    """
+    Fetch a batch of release, recording, and work MBIDs from the musicbrainz API concurrently, and
+    keep the responses for the get_*_by_id functions.  Requests are started at the rate allowed by
+    the TokenBucket (by default, one per second), and each runs in a worker thread, so waiting for
+    and parsing a response overlaps with waiting for the next token.  Responses already prefetched
+    or cached are not requested.  Errors are ignored, since the later synchronous call will repeat
+    the request and report them.  Returns the number of responses fetched.
+    """
+    if bucket is None:
+        bucket = TokenBucket()
+    loop = asyncio.get_running_loop()
+
+    # ----------------------------------------------------------------------------------------------
+    async def fetch(entity, mbid):
+        await bucket.acquire()
+        try:
+            response = await loop.run_in_executor(None, functools.partial(_call_api, entity, mbid))
+        except ngs.MusicBrainzError:
+            return False
+        # Responses stored in the cache need not be kept in memory as well.
+        if _cache is None:
+            _prefetched[(entity, mbid)] = response
+        return True
+
+    requests = []
+    for entity, mbids in (('release', releases), ('recording', recordings), ('work', works)):
+        for mbid in dict.fromkeys(mbids):
+            if _get_cached(entity, mbid) is None:
+                requests.append((entity, mbid))
+    if _offline or len(requests) == 0:
+        return 0
+
+    # The token bucket replaces the musicbrainzngs rate limit, which would otherwise serialize the
+    # requests in the worker threads.
+    ngs.set_rate_limit(False)
+    try:
+        results = await asyncio.gather(*[fetch(entity, mbid) for entity, mbid in requests])
+    finally:
+        ngs.set_rate_limit()
+    return sum(results)
+
+# --------------------------------------------------------------------------------------------------
+def prefetch(releases=(), recordings=(), works=(), rate=1.0):
+    """
+    Synchronous wrapper for prefetch_async(), limited to 'rate' requests per second.  The responses
+    kept by an earlier prefetch are discarded first.  Returns the number of responses fetched.
+    """
+    clear_prefetched()
+    return asyncio.run(prefetch_async(releases, recordings, works, TokenBucket(rate)))
+
+# --------------------------------------------------------------------------------------------------
+def prefetch_parent_works(release, rate=1.0):
+    """
+    Prefetch the works of which the works in a release returned by the musicbrainz API are a part,
+    recursively, one level of the part-of hierarchy at a time.  The responses kept by an earlier
+    prefetch are discarded first, but those of each level are kept for the rest.  Returns the
+    number of responses fetched.
+    """
+    clear_prefetched()
+    works = [work for medium in release.get('media', []) for track in medium.get('tracks', [])
+        for work in get_recording_works(track.get('recording', {}))]
+    seen = set(work['id'] for work in works)
+    count = 0
+    while len(works) > 0:
+        parents = []
+        for work in works:
+            for parent in get_work_partof_works(work):
+                if parent['id'] not in seen:
+                    seen.add(parent['id'])
+                    parents.append(parent['id'])
+        count += asyncio.run(prefetch_async(works=parents, bucket=TokenBucket(rate)))
+        works = [work for work in (_get_cached('work', mbid) for mbid in parents)
+            if work is not None]
+    return count
 
 # --------------------------------------------------------------------------------------------------
 def get_artist_primary_alias(artist, locale='en'):
@@ -228,33 +412,75 @@ def get_work_partof_works(work):
     return result
 
 # --------------------------------------------------------------------------------------------------
-def _get_work_artist_relations(work, recurse=False, locale='en'):
+class WorkLookup(object):
     """
-    Extract the artist relationships from a work returned by the musicbrainz API, optionally
-    recursively following 'part of' relationships making further API calls, as necessary.
+    Memo table of works fetched from the musicbrainz API during a run, so that a parent work shared
+    by many tracks (e.g., the movements of a cantata) is fetched only once.  Counts the API calls
+    made and the calls saved by the memo.
+    """
+    def __init__(self):
+        self._works = {}
+        self._calls = 0
+        self._saved = 0
+
+    # ----------------------------------------------------------------------------------------------
+    @property
+    def calls(self):
+        """Number of works fetched from the API."""
+        return self._calls
+
+    # ----------------------------------------------------------------------------------------------
+    @property
+    def saved(self):
+        """Number of work lookups served from the memo table."""
+        return self._saved
+
+    # ----------------------------------------------------------------------------------------------
+    def get_work_by_id(self, workid):
+        """
+        Return work information, including artist and work ARs, calling the musicbrainz API only
+        the first time a work is requested.
+        """
+        if workid in self._works:
+            self._saved += 1
+        else:
+            self._calls += 1
+            self._works[workid] = get_work_by_id(workid, True)
+        return self._works[workid]
+
+# --------------------------------------------------------------------------------------------------
+def _get_work_artist_relations(work, lookup, visited, locale='en'):
+    """
+    Extract the artist relationships from a work returned by the musicbrainz API, recursively
+    following 'part of' relationships making further API calls, as necessary.  Works in the
+    'visited' set are not followed again, so cyclic part-of relationships terminate.
     """
     result = get_artist_relations(work, locale)
-    if not recurse:
-        return result
+    visited.add(work['id'])
 
     # Recurse through part-of relation parents and add to list.
-    parents = get_work_partof_works(work)
-    for parent in parents:
-        work = get_work_by_id(parent['id'], True)
-        result = result + _get_work_artist_relations(work, True, locale)
-    
+    for parent in get_work_partof_works(work):
+        if parent['id'] not in visited:
+            parent = lookup.get_work_by_id(parent['id'])
+            result = result + _get_work_artist_relations(parent, lookup, visited, locale)
+
     return result
 
 # --------------------------------------------------------------------------------------------------
-def get_work_artist_relations(work, recurse=False, locale='en'):
+def get_work_artist_relations(work, recurse=False, locale='en', lookup=None):
     """
     Extract the artist relationships from a work returned by the musicbrainz API, optionally
     recursively following 'part of' relationships making further API calls, as necessary.  The
     passed API work data must contain the work-artist relations; to recurse, it must also contain
-    one level of work-work relations.  The result is a list of Relation named tuples.  A relation
+    one level of work-work relations.  A WorkLookup shared by the calls in a run avoids fetching the
+    same parent work more than once.  The result is a list of Relation named tuples.  A relation
     type that has no map will be excluded, and duplicates of the same type and artist are removed.
     """
-    return list(set(_get_work_artist_relations(work, recurse, locale)))
+    if not recurse:
+        return get_artist_relations(work, locale)
+    if lookup is None:
+        lookup = WorkLookup()
+    return list(set(_get_work_artist_relations(work, lookup, set(), locale)))
 
 # --------------------------------------------------------------------------------------------------
 def get_earliest_release(release):
@@ -323,6 +549,82 @@ def get_medium_track(medium, number):
                 return track
     return None
 
+# --------------------------------------------------------------------------------------------------
+class ReleaseIndex(object):
+    """
+    Lookup tables built once over a release returned by the musicbrainz API, so that matching each
+    file to its medium and track does not scan the release.  Also memoizes the artists and artist
+    relations extracted from entities, by MBID, since the release, and any recordings and works
+    shared by several tracks, would otherwise be mapped again for every track.
+    """
+    def __init__(self, release, locale='en'):
+        self._release = release
+        self._locale = locale
+        self._media = {}
+        self._tracks = {}
+        self._artists = {}
+        self._relations = {}
+        self._work_relations = {}
+        for medium in release.get('media', []):
+            position = int(medium['position'])
+            # Keep the first match, as a scan of the release would.
+            self._media.setdefault(position, medium)
+            for track in medium.get('tracks', []):
+                self._tracks.setdefault((position, int(track['position'])), track)
+
+    # ----------------------------------------------------------------------------------------------
+    @property
+    def release(self):
+        """The musicbrainz API release object."""
+        return self._release
+
+    # ----------------------------------------------------------------------------------------------
+    def get_medium(self, number):
+        """
+        Return the medium of the release by number, or None if not found.
+        """
+        return self._media.get(int(number))
+
+    # ----------------------------------------------------------------------------------------------
+    def get_track(self, medium_number, number):
+        """
+        Return the track of the release by medium number and track number, or None if not found.
+        """
+        return self._tracks.get((int(medium_number), int(number)))
+
+    # ----------------------------------------------------------------------------------------------
+    def get_artists(self, entity):
+        """
+        Return get_artists() for an entity, reusing the result for an entity with the same MBID.
+        """
+        key = entity['id']
+        if key not in self._artists:
+            self._artists[key] = get_artists(entity, self._locale)
+        return self._artists[key]
+
+    # ----------------------------------------------------------------------------------------------
+    def get_artist_relations(self, entity):
+        """
+        Return get_artist_relations() for an entity, reusing the result for an entity with the same
+        MBID.
+        """
+        key = entity['id']
+        if key not in self._relations:
+            self._relations[key] = get_artist_relations(entity, self._locale)
+        return self._relations[key]
+
+    # ----------------------------------------------------------------------------------------------
+    def get_work_artist_relations(self, work, recurse=False, lookup=None):
+        """
+        Return get_work_artist_relations() for a work, reusing the result for a work with the same
+        MBID.
+        """
+        key = (work['id'], recurse)
+        if key not in self._work_relations:
+            self._work_relations[key] = \
+                get_work_artist_relations(work, recurse, self._locale, lookup)
+        return self._work_relations[key]
+
 # --------------------------------------------------------------------------------------------------
 def get_track_recording(track):
     """
@@ -0,0 +1,121 @@
+# rangeset.py - kantag compact set of disc/track numbers.
+# Copyright (C) 2018 David Gasaway
+# https://github.com/dgasaway/kantag
+
+# This program is free software; you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program; if not,
+# see <http://www.gnu.org/licenses>.
+import bisect
+from . import exceptions
+
+# --------------------------------------------------------------------------------------------------
+def _is_number(s):
+    """
+    Return whether a string is a non-empty string of ASCII digits.
+    """
+    return s.isdigit() and s.isascii()
+
+# --------------------------------------------------------------------------------------------------
+class RangeSet(object):
+    """
+    Represents a set of zero-padded numeric strings, such as the disc/track numbers to which a tag
+    line applies.  Rather than a list of every value, the set stores a list of (start, end, width)
+    spans, e.g., '01-03,05' -> [(1, 3, 2), (5, 5, 2)].  Iterating the set yields the individual
+    values in span order, e.g., '01', '02', '03', '05'.
+    """
+    def __init__(self, range_str=None):
+        self._spans = []
+        # Spans merged by width, as a dictionary of width -> (list of starts, list of ends).  Built
+        # on the first membership test, since many sets are only ever iterated or printed.
+        self._lookup = None
+        if range_str is not None and range_str != '':
+            self._parse(range_str)
+
+    # ----------------------------------------------------------------------------------------------
+    @property
+    def spans(self):
+        """List of (start, end, width) tuples."""
+        return self._spans
+
+    # ----------------------------------------------------------------------------------------------
+    def _parse(self, range_str):
+        """
+        Parse a range string into spans.  Each number in a range should have the same number of
+        digits.
+        """
+        for item in range_str.split(','):
+            (start, sep, end) = item.partition('-')
+            if not _is_number(start) or (sep != '' and not _is_number(end)):
+                raise exceptions.TagFileFormatError(
+                    'Malformed track number range string: ' + range_str)
+            # Store the length of the start value so we can pad all values to this length.
+            self._spans.append((int(start), int(end if sep else start), len(start)))
+
+    # ----------------------------------------------------------------------------------------------
+    def _build_lookup(self):
+        """
+        Build the sorted, non-overlapping spans used for membership tests.
+        """
+        by_width = {}
+        for start, end, width in sorted(self._spans):
+            if start > end:
+                continue
+            merged = by_width.setdefault(width, [])
+            if len(merged) > 0 and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self._lookup = {width: ([s for s, e in merged], [e for s, e in merged])
+            for width, merged in by_width.items()}
+
+    # ----------------------------------------------------------------------------------------------
+    def __contains__(self, value):
+        """
+        Return whether a numeric string is in the set.
+        """
+        if not isinstance(value, str) or not _is_number(value):
+            return False
+        if self._lookup is None:
+            self._build_lookup()
+        num = int(value)
+        for width, (starts, ends) in self._lookup.items():
+            # The value must be padded exactly as it would be by expansion of the range.
+            if str(num).zfill(width) == value:
+                i = bisect.bisect_right(starts, num) - 1
+                if i >= 0 and num <= ends[i]:
+                    return True
+        return False
+
+    # ----------------------------------------------------------------------------------------------
+    def __iter__(self):
+        for start, end, width in self._spans:
+            for i in range(start, end + 1):
+                yield str(i).zfill(width)
+
+    # ----------------------------------------------------------------------------------------------
+    def __len__(self):
+        return sum(max(0, end - start + 1) for start, end, width in self._spans)
+
+    # ----------------------------------------------------------------------------------------------
+    def __str__(self):
+        """
+        Build a range string from the spans.
+        """
+        items = []
+        for start, end, width in self._spans:
+            item = str(start).zfill(width)
+            if end != start:
+                item += '-' + str(end).zfill(width)
+            items.append(item)
+        return ','.join(items)
+
+    # ----------------------------------------------------------------------------------------------
+    def __repr__(self):
+        return 'RangeSet(%r)' % str(self)
@@ -15,197 +15,115 @@
 # You should have received a copy of the GNU General Public License along with this program; if not,
 # see <http://www.gnu.org/licenses>.import os
 import os
-import mutagen.id3
-import mutagen.oggvorbis
-import mutagen.oggopus
-import mutagen.easymp4
+import sys
+import io
+import csv
+import collections
+import pprint
+import mutagen
 import musicbrainzngs as ngs
-from pprint import pprint
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 from .util import ToggleAction
+from .tagset import TagSet
 from ._version import __version__
-from . import exceptions, textencoding, musicbrainz
+from . import exceptions, textencoding, musicbrainz, mbcache, audiofile
 
-# --------------------------------------------------------------------------------------------------
-def remove_key(dictionary, key):
-    """
-    Remove items from a dictionary where the key is a case-insensitive match for a specified key.
-    """
-    for k in [k for k in iter(dictionary) if k.lower() == key.lower()]:
-        del(dictionary[k])
+""" MusicBrainz information about a recording that is applied to files. """
+Recording = collections.namedtuple('Recording', 'id, works, artists')
 
 # --------------------------------------------------------------------------------------------------
-def process_vorbis_file(args):
-    """
-    Add MusicBrainz IDs to an Ogg file.
-    """
-    rec = musicbrainz.get_recording_by_id(args.recording_id)
-    works = musicbrainz.get_recording_works(rec)
-    artists = musicbrainz.get_recording_artists(rec)
-        
-    afile = mutagen.oggvorbis.OggVorbis(args.audio_file)
-    remove_key(afile, 'musicbrainz_trackid')
-    afile['musicbrainz_trackid'] = args.recording_id
-    
-    remove_key(afile, 'musicbrainz_artistid')
-    afile['musicbrainz_artistid'] = [artist['id'] for artist in artists]
-    
-    remove_key(afile, 'musicbrainz_workid')
-    if len(works) > 0:
-        afile['musicbrainz_workid'] = [work['id'] for work in works]
-    
-    if args.write_work and len(works) > 0:
-        remove_key(afile, 'work')
-        for work in works:
-            title = work['title']
-            if args.ascii_punctuation:
-                title = textencoding.asciipunct(title)
-            afile['work'] = title
-    
-    afile.save()
-    
-# --------------------------------------------------------------------------------------------------
-def process_opus_file(args):
+def get_recording(recording_id):
     """
-    Add MusicBrainz IDs to an Ogg file.
+    Call the musicbrainz API and return a Recording named tuple with the works and artists of a
+    recording.
     """
-    rec = musicbrainz.get_recording_by_id(args.recording_id)
+    rec = musicbrainz.get_recording_by_id(recording_id)
     works = musicbrainz.get_recording_works(rec)
     artists = musicbrainz.get_recording_artists(rec)
-        
-    afile = mutagen.oggopus.OggOpus(args.audio_file)
-    remove_key(afile, 'musicbrainz_trackid')
-    afile['musicbrainz_trackid'] = args.recording_id
-    
-    remove_key(afile, 'musicbrainz_artistid')
-    afile['musicbrainz_artistid'] = [artist['id'] for artist in artists]
-    
-    remove_key(afile, 'musicbrainz_workid')
-    if len(works) > 0:
-        afile['musicbrainz_workid'] = [work['id'] for work in works]
-    
-    if args.write_work and len(works) > 0:
-        remove_key(afile, 'work')
-        for work in works:
-            title = work['title']
-            if args.ascii_punctuation:
-                title = textencoding.asciipunct(title)
-            afile['work'] = title
-    
-    afile.save()
+    return Recording(recording_id, works, artists)
 
 # --------------------------------------------------------------------------------------------------
-def process_mp3_file(args):
+def process_file(audio_file, recording, args):
     """
-    Add MusicBrainz IDs to an MP3 file.
+    Apply the MusicBrainz IDs of a Recording to an audio file.  Only the affected tags are changed.
     """
-    rec = musicbrainz.get_recording_by_id(args.recording_id)
-    works = musicbrainz.get_recording_works(rec)
-    artists = musicbrainz.get_recording_artists(rec)
-    
-    afile = mutagen.id3.ID3(args.audio_file)
-    afile.update_to_v24()
-    
-    name = 'MusicBrainz Track Id'
-    afile.delall('TXXX:' + name)
-    afile.delall('TXXX:' + name.upper())
-    afile.delall('TXXX:' + name.lower())
-    afile.add(mutagen.id3.TXXX(encoding=3, desc=name.upper(), text=args.recording_id))
-    
-    name = 'MusicBrainz Artist Id'
-    afile.delall('TXXX:' + name)
-    afile.delall('TXXX:' + name.upper())
-    afile.delall('TXXX:' + name.lower())
-    for artist in artists:
-        afile.add(mutagen.id3.TXXX(encoding=3, desc=name.upper(), text=artist['id']))
-
-    name = 'MusicBrainz Work Id'
-    afile.delall('TXXX:' + name)
-    afile.delall('TXXX:' + name.upper())
-    afile.delall('TXXX:' + name.lower())
-    for work in works:
-        afile.add(mutagen.id3.TXXX(encoding=3, desc=name.upper(), text=work['id']))
-    
-    if args.write_work and len(works) > 0:
-        name = 'Work'
-        afile.delall('TXXX:' + name)
-        afile.delall('TXXX:' + name.upper())
-        afile.delall('TXXX:' + name.lower())
-        for work in works:
-            title = work['title']
+    tags = TagSet()
+    tags['musicbrainz_trackid'] = [recording.id]
+    tags['musicbrainz_artistid'] = [artist['id'] for artist in recording.artists]
+    remove_tags = []
+    if len(recording.works) > 0:
+        tags['musicbrainz_workid'] = [work['id'] for work in recording.works]
+        if args.write_work:
+            titles = [work['title'] for work in recording.works]
             if args.ascii_punctuation:
-                title = textencoding.asciipunct(title)
-            afile.add(mutagen.id3.TXXX(encoding=3, desc=name.upper(), text=title))
+                titles = [textencoding.asciipunct(title) for title in titles]
+            tags['Work'] = titles
+    else:
+        remove_tags.append('musicbrainz_workid')
 
-    afile.save()
+    audiofile.update(audio_file, tags, remove_tags)
 
 # --------------------------------------------------------------------------------------------------
-def process_m4a_file(args):
+def read_mapping(f):
     """
-    Add MusicBrainz IDs to an Ogg file.
+    Read (recording_id, audio_file) pairs from a CSV or TSV mapping file object.  Blank lines and
+    lines starting with '#' are ignored.
     """
-    rec = musicbrainz.get_recording_by_id(args.recording_id)
-    works = musicbrainz.get_recording_works(rec)
-    artists = musicbrainz.get_recording_artists(rec)
+    pairs = []
+    for num, line in enumerate(f, 1):
+        line = line.strip()
+        if line == '' or line.startswith('#'):
+            continue
+        delimiter = '\t' if '\t' in line else ','
+        row = next(csv.reader([line], delimiter=delimiter))
+        if len(row) != 2:
+            raise exceptions.TaggingError(
+                'line {0}: expected a recording id and an audio file: {1}'.format(num, line))
+        pairs.append((row[0].strip(), row[1].strip()))
+    return pairs
 
-    # At time of writing this code, EasyMP4 appeared to have a bug that made it impossible to
-    # completely remove a particular tag from the file.  Even though it would no longer show in the
-    # dictionary, it would still be present in the file after save.  So, the code uses MP4 instead.
-    prefix = '----:com.apple.iTunes:'
-    afile = mutagen.mp4.MP4(args.audio_file)
-
-    remove_key(afile, prefix + 'musicbrainz_trackid')
-    name = prefix + 'MusicBrainz Track Id'
-    remove_key(afile, name)
-    afile[name] = mutagen.mp4.MP4FreeForm(
-        bytes(args.recording_id, 'UTF-8'), 
-        mutagen.mp4.AtomDataType.UTF8)
-
-    remove_key(afile, prefix + 'musicbrainz_artistid')
-    name = prefix + 'MusicBrainz Artist Id'
-    remove_key(afile, name)
-    for artist in artists:
-        afile[name] = mutagen.mp4.MP4FreeForm(
-            bytes(artist['id'], 'UTF-8'), 
-            mutagen.mp4.AtomDataType.UTF8)
-
-    remove_key(afile, prefix + 'musicbrainz_workid')
-    name = prefix + 'MusicBrainz Work Id'
-    remove_key(afile, name)
-    for work in works:
-        afile[name] = mutagen.mp4.MP4FreeForm(
-            bytes(work['id'], 'UTF-8'), 
-            mutagen.mp4.AtomDataType.UTF8)
-
-    if args.write_work and len(works) > 0:
-        name = prefix + 'work'
-        remove_key(afile, name)
-        for work in works:
-            title = work['title']
-            if args.ascii_punctuation:
-                title = textencoding.asciipunct(title)
-            afile[name] = mutagen.mp4.MP4FreeForm(
-            bytes(title, 'UTF-8'), 
-            mutagen.mp4.AtomDataType.UTF8)
-    
-    afile.save()
-    
 # --------------------------------------------------------------------------------------------------
-def process_file(args):
+def process_batch(pairs, args):
     """
-    Search the MP3 file for a UFID tag and copy to MusicBrainz Trac Id, if found.
+    Apply the MusicBrainz IDs of many recordings to many audio files.  Each unique recording is
+    fetched once, and the files are written by a pool of worker threads.  Failures are reported
+    and do not stop the other files.  Returns the number of failures.
     """
-    ext = os.path.splitext(args.audio_file)[1].lower()
-    if ext == '.ogg':
-        return process_vorbis_file(args)
-    elif ext == '.opus':
-        return process_opus_file(args)
-    elif ext == '.mp3':
-        return process_mp3_file(args)
-    elif ext == '.m4a':
-        return process_m4a_file(args)
-    else:
-        raise exceptions.FileTypeError('invalid file extension: ' + ext)
+    # Fetch each unique recording once; the requests are made concurrently at the API rate limit.
+    recording_ids = list(dict.fromkeys(recording_id for recording_id, audio_file in pairs))
+    musicbrainz.prefetch(recordings=recording_ids)
+    recordings = {}
+    errors = {}
+    for recording_id in recording_ids:
+        try:
+            recordings[recording_id] = get_recording(recording_id)
+        except (exceptions.TaggingError, ngs.MusicBrainzError) as e:
+            errors[recording_id] = str(e)
+
+    # ----------------------------------------------------------------------------------------------
+    def process(pair):
+        (recording_id, audio_file) = pair
+        if recording_id in errors:
+            return 'recording {0}: {1}'.format(recording_id, errors[recording_id])
+        try:
+            process_file(audio_file, recordings[recording_id], args)
+        except (exceptions.TaggingError, mutagen.MutagenError, OSError) as e:
+            return str(e)
+        return None
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        for (recording_id, audio_file), error in zip(pairs, executor.map(process, pairs)):
+            if error is None:
+                if args.verbose >= 1:
+                    print(audio_file)
+            else:
+                print('error: {0}: {1}'.format(audio_file, error), file=sys.stderr)
+                failed += 1
+
+    print('{0} files updated, {1} files failed'.format(len(pairs) - failed, failed))
+    return failed
 
 # --------------------------------------------------------------------------------------------------
 def main():
@@ -224,25 +142,67 @@ def main():
         action=ToggleAction, choices=['y', 'n'], default=True)
     parser.add_argument('recording_id',
         help='MusicBrainz identifier for the recording',
-        action='store')
+        action='store', nargs='?')
     parser.add_argument('audio_file',
-        help='audio file (Ogg Vorbis, Ogg Opus, MP3, M4A)',
-        action='store')
+        help='audio file (Ogg Vorbis, Ogg Opus, FLAC, MP3, M4A)',
+        action='store', nargs='?')
     parser.add_argument('-w', '--write_work',
         help='write Work tags [default=y]',
         action=ToggleAction, dest='write_work', choices=['y', 'n'], default=True)
+    parser.add_argument('-b', '--batch',
+        help='apply many recordings, reading "recording_id,audio_file" pairs (comma or tab '
+        'separated, one per line) from a file, or "-" for STDIN, instead of the arguments',
+        metavar='FILE', action='store')
+    parser.add_argument('-j', '--jobs',
+        help='number of files to write concurrently in batch mode [default=4]',
+        metavar='N', action='store', type=int, default=4)
+    parser.add_argument('--no-mb-cache',
+        help='do not use or update the cache of musicbrainz web service responses',
+        action='store_false', dest='mb_cache', default=True)
+    parser.add_argument('--offline',
+        help='only use cached musicbrainz responses, without calling the web service',
+        action='store_true', default=False)
     args = parser.parse_args()
 
     if args.verbose >= 2:
         print('<Arguments>')
         print(pprint.PrettyPrinter(indent=2).pformat(vars(args)) + '\n')
 
+    if args.batch is not None:
+        if args.recording_id is not None:
+            parser.error('a recording id and audio file may not be given with --batch')
+    elif args.recording_id is None or args.audio_file is None:
+        parser.error('a recording id and audio file are required')
     # Check for some files to build tags for.
-    if not os.path.exists(args.audio_file):
+    elif not os.path.exists(args.audio_file):
         parser.error('audio file not found: ' + args.audio_file)
+    if args.jobs < 1:
+        parser.error('number of jobs must be at least 1')
+    if args.offline and not args.mb_cache:
+        parser.error("'--offline' may not be used with '--no-mb-cache'")
+
+    if args.mb_cache:
+        cache = mbcache.open_cache()
+        if cache is None and args.offline:
+            parser.error('the musicbrainz cache is required for offline mode')
+        musicbrainz.set_cache(cache, args.offline)
 
     # Write the output.
-    process_file(args)
+    if args.batch is None:
+        process_file(args.audio_file, get_recording(args.recording_id), args)
+        return
+
+    try:
+        if args.batch == '-':
+            pairs = read_mapping(sys.stdin)
+        else:
+            with io.open(args.batch, mode='rt', encoding='utf-8', newline='') as f:
+                pairs = read_mapping(f)
+    except (exceptions.TaggingError, OSError) as e:
+        print('error: ' + str(e), file=sys.stderr)
+        exit(2)
+    if process_batch(pairs, args) > 0:
+        exit(2)
 
 # --------------------------------------------------------------------------------------------------
 if __name__ == "__main__":
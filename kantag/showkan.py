@@ -20,7 +20,7 @@ import argparse
 import pprint
 from kantag.util import expand_globs
 from kantag.exceptions import TaggingError
-from kantag import audiofile
+from kantag import audiofile, tagcache
 from kantag._version import __version__
 
 # --------------------------------------------------------------------------------------------------
@@ -47,6 +47,9 @@ def main():
     parser.add_argument('-W', '--no-warn',
         help='disable all warnings',
         action='store_false', dest='warn')
+    parser.add_argument('--no-cache',
+        help='do not use or update the tag cache',
+        action='store_false', dest='cache')
     parser.add_argument('audio_files',
         help='audio files (Ogg Vorbis, Ogg Opus, FLAC, MP3, M4A)',
         action='store', metavar='audio_file', nargs='+')
@@ -60,6 +63,9 @@ def main():
     # Expand any glob patterns left by the shell.
     args.audio_files = expand_globs(args.audio_files)
 
+    if args.cache:
+        audiofile.set_cache(tagcache.open_cache(warn=args.warn))
+
     # Write the output.
     try:
         for filename in args.audio_files:
@@ -0,0 +1,188 @@
+# tagcache.py - kantag persistent cache of audio file metadata.
+# Copyright (C) 2018 David Gasaway
+# https://github.com/dgasaway/kantag
+
+# This program is free software; you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program; if not,
+# see <http://www.gnu.org/licenses>.
+import sys
+import os
+import json
+import sqlite3
+import threading
+from .util import TagValue
+from .tagmaps import cannonical_names
+from ._version import __version__
+
+# --------------------------------------------------------------------------------------------------
+def default_path():
+    """
+    Return the default location of the cache database, which is in the user cache folder.
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'kantag', 'tags.sqlite')
+
+# --------------------------------------------------------------------------------------------------
+def _get_key(path):
+    """
+    Get a tuple of (path, size, mtime, inode) identifying the current state of a file.
+    """
+    path = os.path.abspath(str(path))
+    st = os.stat(path)
+    return (path, st.st_size, st.st_mtime_ns, st.st_ino)
+
+# --------------------------------------------------------------------------------------------------
+class TagCache(object):
+    """
+    Persistent cache of the tags read from audio files, stored in an SQLite database.  An entry is
+    only used if the path, size, modification time, and inode of the file are unchanged, and the
+    entry was stored by the same version of kantag.  Instances may be shared between threads.  A
+    database error in get, put, or delete disables the cache for the remainder of the run, as the
+    cache is never required for correct operation.
+    """
+    def __init__(self, path=None, warn=True):
+        self._path = path if path is not None else default_path()
+        self._warn = warn
+        self._failed = False
+        os.makedirs(os.path.dirname(os.path.abspath(self._path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self._path, timeout=30, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS tags (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, '
+            'inode INTEGER, version TEXT, tags TEXT)')
+        self._db.commit()
+
+    # ----------------------------------------------------------------------------------------------
+    @property
+    def path(self):
+        """Path of the cache database."""
+        return self._path
+
+    # ----------------------------------------------------------------------------------------------
+    def _disable(self, e):
+        """
+        Disable the cache after a database error, displaying a warning the first time.  Must be
+        called with the lock held.
+        """
+        if self._warn and not self._failed:
+            print('warning: tag cache disabled: ' + str(e), file=sys.stderr)
+        self._failed = True
+
+    # ----------------------------------------------------------------------------------------------
+    def get(self, path):
+        """
+        Return the cached list of TagValue named tuples for an audio file, or None if there is no
+        valid entry for the file.
+        """
+        (path, size, mtime, inode) = _get_key(path)
+        with self._lock:
+            if self._failed:
+                return None
+            try:
+                row = self._db.execute(
+                    'SELECT tags FROM tags WHERE path=? AND size=? AND mtime=? AND inode=? '
+                    'AND version=?', (path, size, mtime, inode, __version__)).fetchone()
+            except sqlite3.Error as e:
+                self._disable(e)
+                return None
+        if row is None:
+            return None
+        # Share the cannonical tag name strings, rather than keep the copies made by the decoder.
+        return [TagValue(cannonical_names.get(tag, tag), value)
+            for tag, value in json.loads(row[0])]
+
+    # ----------------------------------------------------------------------------------------------
+    def put(self, path, tags):
+        """
+        Store a list of TagValue named tuples read from an audio file.
+        """
+        (path, size, mtime, inode) = _get_key(path)
+        data = json.dumps([[item.tag, item.value] for item in tags])
+        with self._lock:
+            if self._failed:
+                return
+            try:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO tags (path, size, mtime, inode, version, tags) '
+                    'VALUES (?, ?, ?, ?, ?, ?)', (path, size, mtime, inode, __version__, data))
+                self._db.commit()
+            except sqlite3.Error as e:
+                self._disable(e)
+
+    # ----------------------------------------------------------------------------------------------
+    def delete(self, path):
+        """
+        Remove the entry for an audio file, e.g., after the file is written.  The entry would no
+        longer be used anyway, since the file has changed, but this keeps the database small.
+        """
+        path = os.path.abspath(str(path))
+        with self._lock:
+            if self._failed:
+                return
+            try:
+                self._db.execute('DELETE FROM tags WHERE path=?', (path,))
+                self._db.commit()
+            except sqlite3.Error as e:
+                self._disable(e)
+
+    # ----------------------------------------------------------------------------------------------
+    def prune(self):
+        """
+        Remove the entries for files that no longer exist or have changed, and entries stored by
+        other versions of kantag.  Returns the number of entries removed.
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT path, size, mtime, inode, version FROM tags').fetchall()
+            stale = []
+            for row in rows:
+                try:
+                    current = _get_key(row[0]) + (__version__,)
+                except OSError:
+                    current = None
+                if current != tuple(row):
+                    stale.append((row[0],))
+            self._db.executemany('DELETE FROM tags WHERE path=?', stale)
+            self._db.commit()
+            self._db.execute('VACUUM')
+        return len(stale)
+
+    # ----------------------------------------------------------------------------------------------
+    def clear(self):
+        """
+        Remove all entries.  Returns the number of entries removed.
+        """
+        with self._lock:
+            count = self._db.execute('DELETE FROM tags').rowcount
+            self._db.commit()
+            self._db.execute('VACUUM')
+        return count
+
+    # ----------------------------------------------------------------------------------------------
+    def close(self):
+        """
+        Close the cache database.
+        """
+        with self._lock:
+            self._db.close()
+
+# --------------------------------------------------------------------------------------------------
+def open_cache(path=None, warn=True):
+    """
+    Open a TagCache at the given or default location.  If the cache cannot be opened, a warning is
+    displayed and None is returned, since the cache is never required for correct operation.
+    """
+    try:
+        return TagCache(path, warn)
+    except (OSError, sqlite3.Error) as e:
+        if warn:
+            print('warning: unable to open tag cache: ' + str(e), file=sys.stderr)
+        return None
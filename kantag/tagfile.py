@@ -13,19 +13,25 @@
 # You should have received a copy of the GNU General Public License along with this program; if not,
 # see <http://www.gnu.org/licenses>.
 import sys
-import re
+import heapq
 from . import exceptions
 from . import util
 from .listdict import ListDict
 from .tagset import TagSet
+from .rangeset import RangeSet
 from .tagstores import Release, Disc, Track
-from .tagmaps import cannonical_tags
+from .tagmaps import cannonical_tags, cannonical_names
+
+""" Maximum number of values in a line range to expand into the TagFile line index. """
+_max_indexed_range = 16
 
 # --------------------------------------------------------------------------------------------------
 class TagLine(object):
     """
     Represents a line from a kantag tag file.
     """
+    __slots__ = ('_warn', '_source_line', '_line_type', '_applies_to', '_tag', '_value', '_used')
+
     def __init__(self, line=None, line_type=None, applies_to=None, tag=None, value=None, warn=True):
         self._warn = warn
 
@@ -47,7 +53,7 @@ class TagLine(object):
         if line_type is not None:
             self.line_type = line_type
         if applies_to is not None:
-            self._applies_to = applies_to
+            self.applies_to = applies_to
         if tag is not None:
             self.tag = tag
         if value is not None:
@@ -71,10 +77,21 @@ class TagLine(object):
     # ----------------------------------------------------------------------------------------------
     @property
     def applies_to(self):
-        """List of numeric values the line applies to."""
+        """
+        RangeSet of numeric values the line applies to; may be set from a range string.  A string
+        that is not a range, e.g., a track number '3/12' or 'A1' read from an audio file, is kept as
+        is, and the line applies to just that number.
+        """
         return self._applies_to
     @applies_to.setter
     def applies_to(self, value):
+        if isinstance(value, str):
+            try:
+                value = RangeSet(value)
+            except exceptions.TagFileFormatError:
+                # Only lines parsed from a tag file must have a valid range; the numbers of lines
+                # generated from audio files are written as they were read.
+                pass
         self._applies_to = value
 
     # ----------------------------------------------------------------------------------------------
@@ -84,7 +101,7 @@ class TagLine(object):
         return self._tag
     @tag.setter
     def tag(self, value):
-        self._tag = value
+        self._tag = cannonical_names.get(value, value)
         if self.warn and value not in cannonical_tags:
             print('warning: unrecognized tag: ' + value, file=sys.stderr)
 
@@ -120,41 +137,69 @@ class TagLine(object):
         """
         Parse a kantag line into a TagLine.
         """
-        if line.startswith('#'):
+        # Note: Lines are split on their delimiters in a single pass rather than by regular
+        # expression, since parsing is a noticeable cost for large files.  The accepted forms are
+        # the same: '#<comment>', 'a <tag>=<value>', and 'd|t <range> <tag>=<value>', where <tag>
+        # is everything up to the first '=' and <value> must not be empty.
+        line_type = line[0]
+        if line_type == '#':
             # Comment line.
-            pattern = r'^(?P<type>[#])(?P<comment>.*)$'
-            match = re.match(pattern, line)
-            if not match:
-                raise exceptions.TagFileFormatError('Malformed comment tag: ' + line)
-
-            self.line_type = match.group('type')
-            self._value = match.group('comment').strip()
+            self.line_type = line_type
+            self._value = line[1:].strip()
             self._used = True
 
-        elif line.startswith('a'):
+        elif line_type == 'a':
             # Album/release line.
-            pattern = r'^(?P<type>[aA]) (?P<tagname>[^=]*)=(?P<tagvalue>.+)$'
-            match = re.match(pattern, line)
-            if not match:
+            (tag, sep, value) = line[2:].partition('=')
+            if line[1:2] != ' ' or sep == '' or value == '':
                 raise exceptions.TagFileFormatError('Malformed album tag: ' + line)
 
-            self.line_type = match.group('type')
-            self.tag = match.group('tagname')
-            self._value = match.group('tagvalue')
+            self.line_type = line_type
+            self.tag = tag
+            self._value = value
 
         else:
             # Disc or track line.
-            pattern = r'^(?P<type>[dtDT]) ' + \
-                r'(?P<range>(\d+(-\d+)?)(,(\d+(-\d+)?))*) ' + \
-                r'(?P<tagname>[^=]*)=(?P<tagvalue>.+)$'
-            match = re.match(pattern, line)
-            if not match:
+            (range_str, sep, rest) = line[2:].partition(' ')
+            (tag, eq, value) = rest.partition('=')
+            if line_type not in 'dtDT' or line[1:2] != ' ' or range_str == '' or sep == '' or \
+                eq == '' or value == '':
                 raise exceptions.TagFileFormatError('Malformed disc/track tag: ' + line)
+            try:
+                applies_to = RangeSet(range_str)
+            except exceptions.TagFileFormatError:
+                raise exceptions.TagFileFormatError('Malformed disc/track tag: ' + line)
+
+            self.line_type = line_type
+            self._applies_to = applies_to
+            self.tag = tag
+            self._value = value
 
-            self.line_type = match.group('type')
-            self._applies_to = util.expand_ranges(match.group('range'))
-            self.tag = match.group('tagname')
-            self._value = match.group('tagvalue')
+    # ----------------------------------------------------------------------------------------------
+    def applies(self, disc, track):
+        """
+        Return whether the line applies to a track with a given disc number and track number, as
+        determined by TagFile.get_matching.
+        """
+        if self._line_type == 'a':
+            return True
+        elif self._line_type == 'd':
+            return disc is not None and disc in self._get_numbers()
+        elif self._line_type == 't':
+            return track is not None and \
+                (track if disc is None else disc + track) in self._get_numbers()
+        else:
+            return False
+
+    # ----------------------------------------------------------------------------------------------
+    def _get_numbers(self):
+        """
+        Get the numbers the line applies to, as a RangeSet, or a list of the single number kept as
+        is if the applies_to string was not a range.
+        """
+        if isinstance(self._applies_to, str):
+            return [self._applies_to]
+        return self._applies_to
 
     # ----------------------------------------------------------------------------------------------
     def __str__(self):
@@ -177,7 +222,7 @@ class TagLine(object):
     # ----------------------------------------------------------------------------------------------
     def pprint(self):
         s = self._line_type + ': ' + \
-            (', '.join(self._applies_to) if self._applies_to is not None else '[n/a]') + '\t' + \
+            (', '.join(self._get_numbers()) if self._applies_to is not None else '[n/a]') + '\t' + \
             (self._tag + '=' if self._tag is not None else '') + \
             (self._value if self._value is not None else '[no value]')
         return s
@@ -189,6 +234,7 @@ class TagFile(object):
     """
     def __init__(self, warn=True):
         self._lines = []
+        self._index = None
 
     # ----------------------------------------------------------------------------------------------
     @property
@@ -198,6 +244,59 @@ class TagFile(object):
     @lines.setter
     def lines(self, value):
         self._lines = value
+        self._index = None
+
+    # ----------------------------------------------------------------------------------------------
+    def _get_index(self):
+        """
+        Get a tuple of (album positions, disc index, track index), where the album positions are
+        the positions of the 'a' lines, and the indexes are dictionaries keyed by disc number and by
+        disc+track number containing the positions of the 'd' and 't' lines that apply.  All
+        position lists are in ascending order.  The index is built on first use, and rebuilt if
+        lines have since been added or removed.
+        """
+        if self._index is None or self._index[0] != len(self._lines):
+            album = []
+            discs = {}
+            tracks = {}
+            for pos, line in enumerate(self._lines):
+                if line.line_type == 'a':
+                    album.append(pos)
+                elif line.line_type == 'd' or line.line_type == 't':
+                    index = discs if line.line_type == 'd' else tracks
+                    nums = line._get_numbers()
+                    if len(nums) > _max_indexed_range:
+                        # Broad ranges are not expanded into the index; rather, the positions are
+                        # stored under None to be tested for membership on each lookup.
+                        index.setdefault(None, []).append(pos)
+                        continue
+                    for num in nums:
+                        positions = index.setdefault(num, [])
+                        # Guard against a number appearing more than once in a line.
+                        if len(positions) == 0 or positions[-1] != pos:
+                            positions.append(pos)
+            self._index = (len(self._lines), album, discs, tracks)
+        return self._index[1:]
+
+    # ----------------------------------------------------------------------------------------------
+    def _get_positions(self, index, num):
+        """
+        Get the ascending positions of the lines in a disc or track index that apply to a number.
+        """
+        if num is None:
+            return []
+        broad = [pos for pos in index.get(None, []) if num in self._lines[pos]._get_numbers()]
+        if len(broad) == 0:
+            return index.get(num, [])
+        return heapq.merge(index.get(num, []), broad)
+
+    # ----------------------------------------------------------------------------------------------
+    def reindex(self):
+        """
+        Discard the line index used by get_matching.  Needed only if the type or numbers of
+        existing lines are modified in place.
+        """
+        self._index = None
 
     # ----------------------------------------------------------------------------------------------
     def apply_map(self, tag_map):
@@ -214,6 +313,7 @@ class TagFile(object):
                     line.tag = new_tag
         for line in remove:
             self._lines.remove(line)
+        self._index = None
 
     # ----------------------------------------------------------------------------------------------
     def get_matching(self, disc, track):
@@ -221,18 +321,19 @@ class TagFile(object):
         Get a TagSet of tags that should be applied to a track with a given disc number and track
         number.  If a line is used in the process, the 'used' attribue is set to True.
         """
-        # Note: This approach of looping through the lines in one pass has the advantage of
-        # preserving the order of the values for a given tag name as they appear in the file.
+        # Note: Visiting the matching lines in order of position has the advantage of preserving
+        # the order of the values for a given tag name as they appear in the file.
         disctrack = (track if disc is None else disc + track)
+        (album, discs, tracks) = self._get_index()
         result = TagSet()
-        for line in self._lines:
-            if line.line_type == 'a' or \
-                line.line_type == 'd' and disc in line.applies_to or \
-                line.line_type == 't' and disctrack in line.applies_to:
-                    # Record the tag pair.
-                    result.append(line.tag, line.value)
-                    # Flag the line as used.
-                    line.used = True
+        discs = self._get_positions(discs, disc)
+        tracks = self._get_positions(tracks, disctrack)
+        for pos in heapq.merge(album, discs, tracks):
+            line = self._lines[pos]
+            # Record the tag pair.
+            result.append(line.tag, line.value)
+            # Flag the line as used.
+            line.used = True
 
         return result
 
@@ -301,18 +402,23 @@ class TagFileBuilder(object):
         if not isinstance(entities, list):
             entities = [entities]
         
+        # The parent number is the same for every entity, so only look it up once.
+        parent_number = parent.number if parent is not None else None
         nums = []
         for entity in entities:
             if isinstance(entity, Release):
                 pass
             elif isinstance(entity, Disc):
-                nums.append('%s' % entity.number)
+                number = entity.number
+                if number is not None:
+                    nums.append('%s' % number)
             elif isinstance(entity, Track):
-                if entity.number is not None:
-                    if parent is not None and parent.number is not None:
-                        nums.append('%s%s' % (parent.number, entity.number.zfill(2)))
+                number = entity.number
+                if number is not None:
+                    if parent_number is not None:
+                        nums.append('%s%s' % (parent_number, number.zfill(2)))
                     else:
-                        nums.append('%s' % entity.number.zfill(2))
+                        nums.append('%s' % number.zfill(2))
             else:
                 raise exceptions.TaggingError('Unexpected entity type: ' + str(type(entity)))
 
@@ -353,14 +459,18 @@ class TagFileBuilder(object):
         if isinstance(entity, list):
             # First, build a dictionary that has the entities for each value.
             ved = self._get_value_entity_dict(entity, key);
-            # Then sort them by the condensed number list.
-            sorted_values = sorted(ved, key=lambda value: self._get_number_str(ved[value], parent))
+            # Then condense the number list of each value once, since it is both the sort key and
+            # the range of the line, and sort by it.
+            groups = [(self._get_number_str(entities, parent), value, entities[0])
+                for value, entities in ved.items()]
+            groups.sort(key=lambda group: group[0])
             # Now output them in order.
-            for value in sorted_values:
-                self.add_value(ved[value], key, value, parent)
+            for num, value, first in groups:
+                self._add_value(first, num, key, value)
         elif key in entity.tags:
+            num = self._get_number_str(entity, parent)
             for value in entity.tags[key]:
-                self.add_value(entity, key, value, parent)
+                self._add_value(entity, num, key, value)
 
     # ----------------------------------------------------------------------------------------------
     def add_values_as(self, entity, key, as_tag, parent=None):
@@ -369,8 +479,9 @@ class TagFileBuilder(object):
         alternate tag name.
         """
         if key in entity.tags:
+            num = self._get_number_str(entity, parent)
             for value in entity.tags[key]:
-                self.add_value(entity, as_tag, value, parent)
+                self._add_value(entity, num, as_tag, value)
 
     # ----------------------------------------------------------------------------------------------
     def add_values_req(self, entity, key, parent=None):
@@ -378,11 +489,12 @@ class TagFileBuilder(object):
         Add a TagLine built from a TagStore entity and its stored tag values for the key; a line is
         added even if no tags are present for the key.
         """
+        num = self._get_number_str(entity, parent)
         if key in entity.tags:
             for value in entity.tags[key]:
-                self.add_value(entity, key, value, parent)
+                self._add_value(entity, num, key, value)
         else:
-            self.add_value(entity, key, '', parent)
+            self._add_value(entity, num, key, '')
 
     # ----------------------------------------------------------------------------------------------
     def add_values_as_req(self, entity, key, as_tag, parent=None):
@@ -390,11 +502,12 @@ class TagFileBuilder(object):
         Add a TagLine built from a TagStore entity and its stored tag values for the key, but as an
         alternate tag name; a line is added even if no tags are present for the key.
         """
+        num = self._get_number_str(entity, parent)
         if key in entity.tags:
             for value in entity.tags[key]:
-                self.add_value(entity, as_tag, value, parent)
+                self._add_value(entity, num, as_tag, value)
         else:
-            self.add_value(entity, as_tag, '', parent)
+            self._add_value(entity, num, as_tag, '')
 
     # ----------------------------------------------------------------------------------------------
     def add_comment(self, comment):
@@ -210,6 +210,17 @@ general_read_map = {
     'r128_album_gain' : 'replaygain_album_gain'
     }
 
+""" Map lower-case tag names, including general read map names, to cannonical names. """
+cannonical_lookup = {tag.lower(): tag for tag in cannonical_tags}
+cannonical_lookup.update({key: cannonical_lookup[value.lower()]
+    for key, value in general_read_map.items() if value.lower() in cannonical_lookup})
+
+"""
+Map each cannonical tag name to itself, so that tag names read from the tag cache or a tag file can
+share a single string rather than each holding a copy.
+"""
+cannonical_names = {tag: tag for tag in cannonical_tags}
+
 """ Map TIPL involvements to kantag name. """
 tipl_map = {
     'dj-mix': 'DJMixer',
@@ -25,6 +25,49 @@ class TagSet(ListDict):
         """
         Initializes an instance from a list of TagValue named tuples.
         """
+        ListDict.__init__(self)
         if tags is not None:
             for tagvalue in tags:
                 self.append_unique(tagvalue.tag, tagvalue.value)
+
+    # ----------------------------------------------------------------------------------------------
+    @staticmethod
+    def get_common_values(dicts):
+        """
+        Return a new TagSet that contains the values common to all the TagSets passed, in the order
+        of the first TagSet.  Same result as ListDict.get_common_values, but each list is checked
+        against the set that the other TagSets keep for a long list at the same key, so the time is
+        linear in the number of values rather than quadratic.
+        """
+        result = TagSet()
+        for key, values in dicts[0].items():
+            common_values = list(values)
+            for dict2 in dicts[1:]:
+                if key not in dict2:
+                    common_values = []
+                    break
+                found = dict2._sets.get(key, dict2[key])
+                common_values = [value for value in common_values if value in found]
+                if len(common_values) == 0:
+                    break
+            if len(common_values) > 0:
+                result[key] = common_values
+
+        return result
+
+    # ----------------------------------------------------------------------------------------------
+    def remove_dict(self, remove):
+        """
+        Remove all the values from the TagSet that are present in a second dictionary.  Same result
+        as ListDict.remove_dict, but each list is rebuilt once per key, rather than once per value.
+        The second dictionary may have sets rather than lists, which saves building a set for each
+        key when the same values are removed from many TagSets.
+        """
+        for key, values in remove.items():
+            if key in self and len(values) > 0:
+                removed = values if isinstance(values, (set, frozenset)) else set(values)
+                l = [v for v in self[key] if v not in removed]
+                if len(l) == 0:
+                    del self[key]
+                else:
+                    self[key] = l
@@ -17,18 +17,37 @@ import sys
 import os.path
 import warnings
 import pprint
+from concurrent.futures import ThreadPoolExecutor
 from .tagset import TagSet
 from . import audiofile, util, textencoding
-try:
-    from . import musicbrainz as mb
-except ImportError:
-    mb = None
+
+""" The musicbrainz module, or None if it has not been imported. """
+mb = None
+
+# --------------------------------------------------------------------------------------------------
+def _import_musicbrainz():
+    """
+    Import the musicbrainz module on first use, rather than at startup, since it loads and
+    configures the musicbrainzngs web service client.  Returns the module, or None if musicbrainzngs
+    is not installed.
+    """
+    global mb
+    if mb is None:
+        try:
+            from . import musicbrainz
+        except ImportError:
+            return None
+        mb = musicbrainz
+    return mb
 
 # --------------------------------------------------------------------------------------------------
 class TagStore(object):
     """
-    Base class that exposes an internal TagSet as a tags property.
+    Base class that exposes an internal TagSet as a tags property.  The classes are slotted, since a
+    library scan can hold many thousands of them.
     """
+    __slots__ = ('_tags', '_children')
+
     def __init__(self):
         self._tags = TagSet()
         self._children = []
@@ -47,7 +66,10 @@ class Track(TagStore):
     """
     Container for track information and tags.
     """
+    __slots__ = ()
+
     def __init__(self, number=None):
+        TagStore.__init__(self)
         if number is not None:
             self._tags['TrackNumber'] = [number]
 
@@ -70,12 +92,15 @@ class Disc(TagStore):
     """
     Container for disc information, tracks, and tags.
     """
-    def __init__(self, number):
+    __slots__ = ('_is_single_artist', '_is_various', '_track_index')
+
+    def __init__(self, number=None):
         TagStore.__init__(self)
         if number is not None:
             self._tags['DiscNumber'] = [number]
         self._is_single_artist = None
         self._is_various = None
+        self._track_index = {}
 
     # ----------------------------------------------------------------------------------------------
     @property
@@ -110,11 +135,30 @@ class Disc(TagStore):
     # ----------------------------------------------------------------------------------------------
     @property
     def tracks(self):
-        """List of Tracks on the disc."""
+        """List of Tracks on the disc.  Tracks appended directly to the list are not indexed."""
         return self._children
     @tracks.setter
     def tracks(self, value):
         self._children = value
+        self._track_index = {}
+        for track in value:
+            self._track_index.setdefault(track.number, track)
+
+    # ----------------------------------------------------------------------------------------------
+    def add_track(self, track):
+        """
+        Add a Track to the disc, and index it by track number for get_track.
+        """
+        self._children.append(track)
+        self._track_index.setdefault(track.number, track)
+
+    # ----------------------------------------------------------------------------------------------
+    def get_track(self, number):
+        """
+        Return the first Track added with a track number, as stored in the tags, or None if there is
+        no such track.
+        """
+        return self._track_index.get(number)
 
     # ----------------------------------------------------------------------------------------------
     def replace_all(self, key, replace, replacement):
@@ -141,10 +185,13 @@ class Release(TagStore):
     """
     Container for release information, discs, and tags.
     """
+    __slots__ = ('_is_single_artist', '_is_various', '_disc_index')
+
     def __init__(self):
         TagStore.__init__(self)
         self._is_single_artist = None
         self._is_various = None
+        self._disc_index = {}
 
     # ----------------------------------------------------------------------------------------------
     @property
@@ -170,11 +217,44 @@ class Release(TagStore):
     # ----------------------------------------------------------------------------------------------
     @property
     def discs(self):
-        """List of Discs contained in the release."""
+        """
+        List of Discs contained in the release.  Discs appended directly to the list are not
+        indexed.
+        """
         return self._children
     @discs.setter
     def discs(self, value):
         self._children = value
+        self._disc_index = {}
+        for disc in value:
+            self._disc_index.setdefault(disc.number, disc)
+
+    # ----------------------------------------------------------------------------------------------
+    def add_disc(self, disc):
+        """
+        Add a Disc to the release, and index it by disc number for get_disc and get_track.
+        """
+        self._children.append(disc)
+        self._disc_index.setdefault(disc.number, disc)
+
+    # ----------------------------------------------------------------------------------------------
+    def get_disc(self, number):
+        """
+        Return the first Disc added with a disc number, as stored in the tags, or None if there is
+        no such disc.  The number is None for a disc of tracks without a disc number.  Discs are
+        indexed when added, so they are found even if the disc number tag is later merged into the
+        release tags.
+        """
+        return self._disc_index.get(number)
+
+    # ----------------------------------------------------------------------------------------------
+    def get_track(self, disc, track):
+        """
+        Return the Track with a track number on the Disc with a disc number, or None if there is no
+        such track.
+        """
+        d = self._disc_index.get(disc)
+        return None if d is None else d.get_track(track)
 
     # ----------------------------------------------------------------------------------------------
     def replace_all(self, key, replace, replacement):
@@ -259,8 +339,9 @@ class _TagStoreBuilder(object):
         self._set_artist_statuses(common_values, various)
 
         # Remove the common child values from the originating children.
+        removed = {key: set(values) for key, values in common_values.items()}
         for child in entity._children:
-            child.tags.remove_dict(common_values)
+            child.tags.remove_dict(removed)
 
 # --------------------------------------------------------------------------------------------------
 class TrackBuilder(_TagStoreBuilder):
@@ -358,11 +439,12 @@ class TrackBuilder(_TagStoreBuilder):
             tags['Performer'] = util.remove_artist_roles(tags['Performer'])
 
     # ----------------------------------------------------------------------------------------------
-    def _apply_release_data(self, mb_release):
+    def _apply_release_data(self, mb_index):
         """
         Apply release-level musicbrainz metadata to track tags.
         """
         tags = self.track.tags
+        mb_release = mb_index.release
 
         if self._options.verbose >= 3:
             pprint.pprint(mb_release, stream=sys.stderr)
@@ -375,7 +457,7 @@ class TrackBuilder(_TagStoreBuilder):
         #for ac in mb_release['artist-credit']:
         #    tags.append_unique('musicbrainz_albumartistid', ac['artist']['id'])
             
-        artists = mb.get_artists(mb_release, self._options.locale)
+        artists = mb_index.get_artists(mb_release)
         tags['AlbumArtists'] = [artist.name for artist in artists]
         tags['AlbumArtistsSort'] = [artist.sortname for artist in artists]
         if len(artists) == 1:
@@ -406,7 +488,7 @@ class TrackBuilder(_TagStoreBuilder):
             tags['CatalogNumber'] = [catnum]
         
         # Add the artist relations using sortnames.
-        self.apply_musicbrainz_relations(mb.get_artist_relations(mb_release, self._options.locale))
+        self.apply_musicbrainz_relations(mb_index.get_artist_relations(mb_release))
         
     # ----------------------------------------------------------------------------------------------
     def _apply_medium_data(self, mb_medium):
@@ -418,7 +500,7 @@ class TrackBuilder(_TagStoreBuilder):
             tags['DiscSubtitle'] = [mb_medium['title']]
 
     # ----------------------------------------------------------------------------------------------
-    def _apply_track_data(self, mb_track):
+    def _apply_track_data(self, mb_track, mb_index):
         """
         Apply track-level musicbrainz metadata to track tags.  Returns whether a track title was
         found.
@@ -432,7 +514,7 @@ class TrackBuilder(_TagStoreBuilder):
         if found_title:
             tags['Title'] = [mb_track['title']]
 
-        artists = mb.get_artists(mb_track, self._options.locale)
+        artists = mb_index.get_artists(mb_track)
         tags['Artists'] = [artist.name for artist in artists]
         tags['ArtistsSort'] = [artist.sortname for artist in artists]
         if len(artists) == 1:
@@ -442,7 +524,7 @@ class TrackBuilder(_TagStoreBuilder):
         return found_title
 
     # ----------------------------------------------------------------------------------------------
-    def _apply_recording_data(self, mb_recording, apply_title):
+    def _apply_recording_data(self, mb_recording, apply_title, mb_index):
         """
         Apply recording-level musicbrainz metadata to the track tags.  'apply_title' indicates
         whether recording title should overwrite an existing title tag.
@@ -458,16 +540,15 @@ class TrackBuilder(_TagStoreBuilder):
             tags.append_unique('Version', mb_recording['disambiguation'])
 
         # Add the artist relations using sortnames.
-        locale = self._options.locale
-        self.apply_musicbrainz_relations(mb.get_artist_relations(mb_recording, locale))
+        self.apply_musicbrainz_relations(mb_index.get_artist_relations(mb_recording))
 
     # ----------------------------------------------------------------------------------------------
-    def _apply_work_data(self, mb_work, recurse, apply_title):
+    def _apply_work_data(self, mb_work, recurse, apply_title, mb_index, work_lookup=None):
         """
         Apply work-level musicbrainz metadata to the track tags.  'apply_title' indicates whether
         the work tile hould be appended to the 'Work' and/or 'Part' tags.  'recuse' indicates
         whether to follow available links to related works, potentially enhancing available
-        work/part data.
+        work/part data, using the optional 'work_lookup' to avoid repeated API calls.
         """
         tags = self.track.tags
 
@@ -489,20 +570,24 @@ class TrackBuilder(_TagStoreBuilder):
 
 
         # Add the artist relations using sortnames.
-        rels = mb.get_work_artist_relations(mb_work, recurse, self._options.locale)
+        rels = mb_index.get_work_artist_relations(mb_work, recurse, work_lookup)
         self.apply_musicbrainz_relations(rels)
 
     # ----------------------------------------------------------------------------------------------
-    def apply_musicbrainz(self, mbdata):
+    def apply_musicbrainz(self, mbdata, work_lookup=None, mb_index=None):
         """
         Apply musicbrainz metadata to the track tags.  'mbdata' should be a release instance
         returned by the musicbrainz API.  The track needs 'TrackNumber' and 'DiscNumber' tags to
-        receive medium, track, recording, and work metadata.
+        receive medium, track, recording, and work metadata.  If the 'recurse_works' option is set,
+        artist relations of parent works are also applied, fetched through the optional
+        'work_lookup' memo table.  'mb_index' is an optional ReleaseIndex over 'mbdata', which
+        should be shared by all the tracks of the release.
         """
         # Bail out of musicbrainz is not available.
-        if mb is None:
+        if _import_musicbrainz() is None:
             print('warning: musicbrainz package is not available', file=sys.stderr)
-        
+            return
+
         # Note: All data is initially loaded into track tags - from existing tags, inferred from
         # path, etc.  On the other hand, musicbrainz data is hierarchical.  Which means, in order
         # to edit existing data with musicbrainz data, we need to either first merge track data to
@@ -513,10 +598,12 @@ class TrackBuilder(_TagStoreBuilder):
         # data is applied to track objects only.
 
         tags = self.track.tags
+        if mb_index is None:
+            mb_index = mb.ReleaseIndex(mbdata, self._options.locale)
         
-        self._apply_release_data(mbdata)
+        self._apply_release_data(mb_index)
         medium_num = (tags['DiscNumber'][0] if 'DiscNumber' in tags else '1')
-        mb_medium = mb.get_release_medium(mbdata, medium_num)
+        mb_medium = mb_index.get_medium(medium_num)
         if not mb_medium is None:
             self._apply_medium_data(mb_medium)
 
@@ -525,21 +612,21 @@ class TrackBuilder(_TagStoreBuilder):
                 print('warning: file track number unknown; cannot match to musicbrainz',
                     file=sys.stderr)
             else:
-                mb_track = mb.get_medium_track(mb_medium, self.track.number)
+                mb_track = mb_index.get_track(medium_num, self.track.number)
             if not mb_track is None:
                 # If the track title matches the recording title, then the API will not include a
                 # title on the track, so we need to pull it from the recording instead.
-                found_title = self._apply_track_data(mb_track)
+                found_title = self._apply_track_data(mb_track, mb_index)
 
                 mb_recording = mb.get_track_recording(mb_track)
                 if not mb_recording is None:
-                    self._apply_recording_data(mb_recording, not found_title)
+                    self._apply_recording_data(mb_recording, not found_title, mb_index)
 
                     # Only apply the work title from the first.
                     apply_title = True
                     for mb_work in mb.get_recording_works(mb_recording):
-                        # TODO: Make work recursion an option.
-                        self._apply_work_data(mb_work, False, apply_title)
+                        self._apply_work_data(mb_work, self._options.recurse_works, apply_title,
+                            mb_index, work_lookup)
                         apply_title = False
 
 # --------------------------------------------------------------------------------------------------
@@ -573,6 +660,8 @@ class ReleaseBuilder(_TagStoreBuilder):
     def __init__(self, options, release=None):
         _TagStoreBuilder.__init__(self, options, release)
         self._musicbrainz_data = None
+        self._musicbrainz_index = None
+        self._work_lookup = None
         if self._entity is None:
             self._entity = Release()
 
@@ -590,6 +679,7 @@ class ReleaseBuilder(_TagStoreBuilder):
     @musicbrainz_data.setter
     def musicbrainz_data(self, value):
         self._musicbrainz_data = value
+        self._musicbrainz_index = None
 
     # ----------------------------------------------------------------------------------------------
     def merge_discs(self):
@@ -599,11 +689,11 @@ class ReleaseBuilder(_TagStoreBuilder):
         self._merge_children(self._options.various, self._options.keep_common)
 
     # ----------------------------------------------------------------------------------------------
-    def _get_track(self, filename):
+    def _read_track(self, filename):
         """
-        Get the tags for file sourced from the existing tags in the file, the filename and path (if
-        the existing tags have gaps and can be inferred from filename/path).  Also does some release
-        and track title parsing based on musicbrainz-originated titles.
+        Get a Track with tags sourced from the existing tags in the file and the filename and path
+        (if the existing tags have gaps and can be inferred from filename/path).  The edits here
+        depend only on the file, so this may safely run concurrently for different files.
         """
         builder = TrackBuilder(self._options)
         builder.read(filename)
@@ -620,6 +710,31 @@ class ReleaseBuilder(_TagStoreBuilder):
         if self._options.parse_disc:
             builder.split_disc_title()
 
+        return builder.track
+
+    # ----------------------------------------------------------------------------------------------
+    def _read_tracks(self, filenames):
+        """
+        Generate (filename, Track) tuples for the given files, in the order given.  If more than one
+        job is requested, the files are read concurrently by a pool of worker threads.
+        """
+        if self._options.jobs > 1:
+            with ThreadPoolExecutor(max_workers=self._options.jobs) as executor:
+                # Note: map() returns results in the order of the input, regardless of the order in
+                # which the reads complete, so disc/track merging remains deterministic.
+                yield from zip(filenames, executor.map(self._read_track, filenames))
+        else:
+            for filename in filenames:
+                yield (filename, self._read_track(filename))
+
+    # ----------------------------------------------------------------------------------------------
+    def _get_track(self, track):
+        """
+        Complete the tags for a Track read from a file.  Does some release and track title parsing
+        based on musicbrainz-originated titles, and applies musicbrainz data if requested.
+        """
+        builder = TrackBuilder(self._options, track)
+
         # Temporarily make sure everything is 'Various Artists' so we don't have issues with unique
         # appends or replaces with mismatched values.
         tags = builder.track.tags
@@ -636,7 +751,8 @@ class ReleaseBuilder(_TagStoreBuilder):
         # multi-disc release.  This is an artifact of the days when musicbrainz represented each
         # disc as a different release.  However, the API will return the same full release metadata
         # for either mbid.
-        if self._options.call_musicbrainz and self.musicbrainz_data is None:
+        if self._options.call_musicbrainz and self.musicbrainz_data is None \
+            and _import_musicbrainz() is not None:
             release_id = self._options.release_mbid
             if release_id is None and 'musicbrainz_albumid' in tags:
                 release_id = tags['musicbrainz_albumid'][0]
@@ -644,9 +760,19 @@ class ReleaseBuilder(_TagStoreBuilder):
                 print('warning: no release id available for musicbrainz lookup', file=sys.stderr)
             else:
                 self.musicbrainz_data = mb.get_release_by_id(release_id)
-
-        if not self.musicbrainz_data is None:
-            builder.apply_musicbrainz(self.musicbrainz_data)
+                # Fetch the parent works concurrently now, rather than one by one for each track.
+                if self._options.recurse_works:
+                    mb.prefetch_parent_works(self.musicbrainz_data)
+
+        if not self.musicbrainz_data is None and _import_musicbrainz() is not None:
+            # Index the release once, rather than scanning it for each track.
+            if self._musicbrainz_index is None:
+                self._musicbrainz_index = \
+                    mb.ReleaseIndex(self.musicbrainz_data, self._options.locale)
+            if self._work_lookup is None:
+                self._work_lookup = mb.WorkLookup()
+            builder.apply_musicbrainz(
+                self.musicbrainz_data, self._work_lookup, self._musicbrainz_index)
 
         # Parse track title into work/part.
         if self._options.parse_title:
@@ -694,12 +820,11 @@ class ReleaseBuilder(_TagStoreBuilder):
 
         # Check if this is the first encounter with a certain disc number.
         discnum = (track.tags['DiscNumber'][0] if 'DiscNumber' in track.tags else None)
-        if not discnum in [d.number for d in release.discs]:
+        disc = release.get_disc(discnum)
+        if disc is None:
             # Initialize a new disc object.
             disc = Disc(discnum)
-            release.discs.append(disc)
-        else:
-            disc = [d for d in release.discs if d.number == discnum][0]
+            release.add_disc(disc)
 
         return disc
 
@@ -712,16 +837,21 @@ class ReleaseBuilder(_TagStoreBuilder):
         """
         release = self.release
 
-        for filename in filenames:
+        for filename, track in self._read_tracks(filenames):
             if self._options.verbose >= 1:
                 print(filename, file=sys.stderr)
 
-            # Fetch the tags that are stored in the file/path.
-            track = self._get_track(filename)
+            # Complete the tags that were read from the file/path.
+            track = self._get_track(track)
 
             # Get a new or existing Disc matching the track.
             disc = self._get_disc(track)
-            disc.tracks.append(track)
+            disc.add_track(track)
+
+        if self._options.verbose >= 1 and self._work_lookup is not None and \
+            self._options.recurse_works:
+            print('musicbrainz parent works: {0} fetched, {1} API calls saved'.format(
+                self._work_lookup.calls, self._work_lookup.saved), file=sys.stderr)
 
         for disc in release.discs:
             # Merge values that are common to all tracks in a disc into the disc tags.
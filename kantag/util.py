@@ -94,18 +94,22 @@ def parse_album_title(full_title):
     else:
         return AlbumTitle(full_title, None, None)
 
+""" Patterns for validating a range string and parsing a range item. """
+_range_str_pattern = re.compile(r'^(\d+(-\d+)?)(,(\d+(-\d+)?))*$')
+_range_item_pattern = re.compile(r'(?P<start>\d+)-(?P<end>\d+)')
+
 # --------------------------------------------------------------------------------------------------
 def expand_ranges(range_str):
     """
     Expand a range string into a list of individual values, e.g., '01-03,05' -> ['01', '02, '03',
     '05'].  Each number in the string should have the same number of digits.
     """
-    if not re.match(r'^(\d+(-\d+)?)(,(\d+(-\d+)?))*$', range_str):
+    if not _range_str_pattern.match(range_str):
         raise exceptions.TagFileFormatError('Malformed track number range string: ' + range_str)
 
     result = []
     for item in range_str.split(','):
-        match = re.match(r'(?P<start>\d+)-(?P<end>\d+)', item)
+        match = _range_item_pattern.match(item)
         if match:
             # Store the length of the start value so we can pad all values to
             # this length.
@@ -121,6 +125,17 @@ def expand_ranges(range_str):
 
     return result
 
+# --------------------------------------------------------------------------------------------------
+def _range_int(num):
+    """
+    Convert a numeric string of a range to an integer, raising a TrackNumberError if it is not
+    numeric.
+    """
+    try:
+        return int(num)
+    except ValueError:
+        raise exceptions.TrackNumberError(num)
+
 # --------------------------------------------------------------------------------------------------
 def condense_ranges(nums):
     """
@@ -131,9 +146,12 @@ def condense_ranges(nums):
     base = 0
     ranges = []
     nums = sorted([num for num in nums if not num is None])
+    # Convert each number just once for the gap checks.  A single number is passed through as is,
+    # so it need not be numeric, e.g., a track number '3/12' read from an ID3 tag.
+    ints = [_range_int(num) for num in nums] if len(nums) > 1 else []
     for idx in range(len(nums)):
         # If last index, or there is a gap before the next value, then output a range.
-        if (idx == len(nums) - 1) or (int(nums[idx + 1]) - int(nums[idx]) > 1):
+        if (idx == len(nums) - 1) or (ints[idx + 1] - ints[idx] > 1):
             ranges.append(('' if idx == base else str(nums[base]) + '-') + str(nums[idx]))
             # Next value will start the next range.
             base = idx + 1
@@ -0,0 +1,177 @@
+# watch.py - kantag file change monitoring.
+# Copyright (C) 2018 David Gasaway
+# https://github.com/dgasaway/kantag
+
+# This program is free software; you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program; if not,
+# see <http://www.gnu.org/licenses>.
+import os
+import time
+import struct
+import select
+import ctypes
+import ctypes.util
+from pathlib import Path
+
+# Globals
+""" inotify event masks, from <sys/inotify.h>. """
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_ISDIR = 0x40000000
+_IN_CLOEXEC = 0o2000000
+""" Events that indicate a file in a watched folder was written, replaced, or removed. """
+_watch_mask = _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+""" Layout of the fixed part of an inotify event: wd, mask, cookie, len. """
+_event_struct = struct.Struct('iIII')
+
+# --------------------------------------------------------------------------------------------------
+class InotifyWatcher(object):
+    """
+    Reports changes to files in a set of folders, and, optionally, their subfolders, using Linux
+    inotify.  Files are watched through their folder, so a file replaced by an editor that saves to
+    a temporary file and renames it is still reported.
+    """
+    def __init__(self, folders, recursive=False):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init1(_IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._recursive = recursive
+        self._folders = {}
+        for folder in folders:
+            self._add_folder(os.path.abspath(str(folder)))
+
+    # ----------------------------------------------------------------------------------------------
+    def _add_folder(self, folder):
+        """
+        Watch a folder, and, in recursive mode, its subfolders.
+        """
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(folder), _watch_mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed: ' + folder)
+        self._folders[wd] = folder
+        if self._recursive:
+            for entry in os.scandir(folder):
+                if entry.is_dir(follow_symlinks=False):
+                    self._add_folder(entry.path)
+
+    # ----------------------------------------------------------------------------------------------
+    def wait(self, timeout=None):
+        """
+        Wait up to 'timeout' seconds, or indefinitely if None, for changes.  Returns the set of
+        paths of the changed files, which is empty if the timeout expired.
+        """
+        (ready, _, _) = select.select([self._fd], [], [], timeout)
+        if len(ready) == 0:
+            return set()
+
+        changed = set()
+        data = os.read(self._fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            (wd, mask, cookie, length) = _event_struct.unpack_from(data, offset)
+            offset += _event_struct.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if wd not in self._folders or name == '':
+                continue
+            path = os.path.join(self._folders[wd], name)
+            if mask & _IN_ISDIR:
+                if self._recursive and mask & (_IN_CREATE | _IN_MOVED_TO):
+                    self._add_folder(path)
+            else:
+                changed.add(path)
+        return changed
+
+    # ----------------------------------------------------------------------------------------------
+    def close(self):
+        os.close(self._fd)
+
+# --------------------------------------------------------------------------------------------------
+class PollingWatcher(object):
+    """
+    Reports changes to files matching a pattern in a set of folders, and, optionally, their
+    subfolders, by periodically comparing modification times.  Used where inotify is unavailable.
+    """
+    def __init__(self, folders, recursive=False, pattern='*.kan', interval=1.0):
+        self._folders = [os.path.abspath(str(folder)) for folder in folders]
+        self._recursive = recursive
+        self._pattern = pattern
+        self._interval = interval
+        self._state = self._scan()
+
+    # ----------------------------------------------------------------------------------------------
+    def _scan(self):
+        """
+        Get a dictionary of path -> (size, modification time) of the matching files.
+        """
+        state = {}
+        for folder in self._folders:
+            paths = Path(folder).rglob(self._pattern) if self._recursive \
+                else Path(folder).glob(self._pattern)
+            for path in paths:
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue
+                state[str(path)] = (st.st_size, st.st_mtime_ns)
+        return state
+
+    # ----------------------------------------------------------------------------------------------
+    def wait(self, timeout=None):
+        """
+        Wait up to 'timeout' seconds, or indefinitely if None, for changes.  Returns the set of
+        paths of the changed files, which is empty if the timeout expired.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            state = self._scan()
+            changed = set(path for path in set(state) | set(self._state)
+                if state.get(path) != self._state.get(path))
+            self._state = state
+            if len(changed) > 0:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            delay = self._interval
+            if deadline is not None:
+                delay = min(delay, max(0, deadline - time.monotonic()))
+            time.sleep(delay)
+
+    # ----------------------------------------------------------------------------------------------
+    def close(self):
+        pass
+
+# --------------------------------------------------------------------------------------------------
+def open_watcher(folders, recursive=False):
+    """
+    Return an InotifyWatcher for the folders, or a PollingWatcher if inotify is unavailable.
+    """
+    try:
+        return InotifyWatcher(folders, recursive)
+    except (OSError, AttributeError):
+        return PollingWatcher(folders, recursive)
+
+# --------------------------------------------------------------------------------------------------
+def wait_for_changes(watcher, debounce=0.5):
+    """
+    Wait for changes, then keep collecting changes until none are reported for 'debounce' seconds,
+    so that a burst of events from a single save is handled once.  Returns the set of paths of the
+    changed files.
+    """
+    changed = watcher.wait()
+    while True:
+        more = watcher.wait(debounce)
+        if len(more) == 0:
+            return changed
+        changed |= more
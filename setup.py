@@ -39,7 +39,10 @@ setup(
             'applykan = kantag.applykan:main',
             'initkan = kantag.initkan:main',
             'showkan = kantag.showkan:main',
-            'setrecording = kantag.setrecording:main'
+            'setrecording = kantag.setrecording:main',
+            'cachekan = kantag.cachekan:main',
+            'kantagd = kantag.kantagd:main',
+            'kantagc = kantag.kantagc:main'
         ],
     },
     python_requires='~=3.7',
@@ -0,0 +1,36 @@
+import struct
+import pytest
+
+# --------------------------------------------------------------------------------------------------
+def _atom(name, data):
+    return struct.pack('>I4s', 8 + len(data), name) + data
+
+# --------------------------------------------------------------------------------------------------
+def _make_m4a(path):
+    mvhd = _atom(b'mvhd', b'\0' * 4 + struct.pack('>IIII', 0, 0, 1000, 1000) + b'\0' * 80)
+    hdlr = _atom(b'hdlr', b'\0' * 8 + b'mdirappl' + b'\0' * 9)
+    meta = _atom(b'meta', b'\0' * 4 + hdlr + _atom(b'ilst', b''))
+    moov = _atom(b'moov', mvhd + _atom(b'udta', meta))
+    path.write_bytes(_atom(b'ftyp', b'M4A \0\0\0\0M4A mp42isom') + moov + _atom(b'mdat', b''))
+
+# --------------------------------------------------------------------------------------------------
+def _make_flac(path):
+    info = struct.pack('>HH3s3sQ', 4096, 4096, b'\0' * 3, b'\0' * 3,
+        (44100 << 44) | (1 << 41) | (15 << 36)) + b'\0' * 16
+    path.write_bytes(b'fLaC' + bytes([0x80, 0, 0, len(info)]) + info)
+
+# --------------------------------------------------------------------------------------------------
+@pytest.fixture
+def make_m4a():
+    """
+    A function that writes an m4a file with no audio and an empty tag list to a path.
+    """
+    return _make_m4a
+
+# --------------------------------------------------------------------------------------------------
+@pytest.fixture
+def make_flac():
+    """
+    A function that writes a flac file with no audio, holding only a STREAMINFO block, to a path.
+    """
+    return _make_flac
@@ -0,0 +1,77 @@
+import pytest
+from kantag import applykan
+from kantag.exceptions import TaggingError
+
+# --------------------------------------------------------------------------------------------------
+@pytest.fixture
+def folder(tmp_path, monkeypatch):
+    """
+    A folder with a tag file and empty audio files, whose writes are recorded rather than made.
+    """
+    monkeypatch.chdir(tmp_path)
+    for name in ('01 - One.flac', '02 - Two.flac'):
+        (tmp_path / name).touch()
+    (tmp_path / 'tags.kan').write_text('a Album=Album\nt 01 Title=One\nt 02 Title=Two\n')
+    return tmp_path
+
+# --------------------------------------------------------------------------------------------------
+def _watch(monkeypatch, jobs=1):
+    args = applykan.parse_args(['--watch', '-W', '-j', str(jobs), 'tags.kan'])
+    state = applykan.WatchedTagFile(args.tag_file, args.audio_files, args, args.audio_folder)
+    written = []
+    monkeypatch.setattr(applykan, 'write_tags_to_file',
+        lambda tags, filename, args, mfst=None: written.append(filename.name) or True)
+    return (args, state, written)
+
+# --------------------------------------------------------------------------------------------------
+def test_failed_write_is_retried(folder, monkeypatch):
+    (args, state, written) = _watch(monkeypatch)
+    assert applykan.apply_watched(state, args, None, True) == [True, True]
+
+    (folder / 'tags.kan').write_text('a Album=Album\nt 01 Title=Uno\nt 02 Title=Two\n')
+    def fail(tags, filename, args, mfst=None):
+        raise TaggingError('disk full')
+    with monkeypatch.context() as m:
+        m.setattr(applykan, 'write_tags_to_file', fail)
+        with pytest.raises(TaggingError):
+            applykan.apply_watched(state, args)
+
+    # Saved again with no further edits, the failed change is still pending.
+    written.clear()
+    assert applykan.apply_watched(state, args) == [True]
+    assert written == ['01 - One.flac']
+    written.clear()
+    assert applykan.apply_watched(state, args) == []
+
+# --------------------------------------------------------------------------------------------------
+def test_added_audio_file_is_written(folder, monkeypatch):
+    (args, state, written) = _watch(monkeypatch)
+    applykan.apply_watched(state, args, None, True)
+
+    (folder / '03 - Three.flac').touch()
+    written.clear()
+    assert applykan.apply_watched(state, args) == [True]
+    assert written == ['03 - Three.flac']
+
+# --------------------------------------------------------------------------------------------------
+def test_jobs_use_executor(folder, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    (args, state, written) = _watch(monkeypatch, jobs=2)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        assert applykan.apply_watched(state, args, executor, True) == [True, True]
+    assert sorted(written) == ['01 - One.flac', '02 - Two.flac']
+
+# --------------------------------------------------------------------------------------------------
+def test_unused_changed_line_warns(folder, monkeypatch, capsys):
+    (args, state, written) = _watch(monkeypatch)
+    args.warn = True
+    args.warn_unrecognized = False
+    applykan.apply_watched(state, args, None, True)
+    capsys.readouterr()
+
+    (folder / 'tags.kan').write_text(
+        'a Album=Album\nt 01 Title=One\nt 02 Title=Two\nt 09 Title=Nine\n')
+    applykan.apply_watched(state, args)
+    err = capsys.readouterr().err
+    assert 'unused tag line:\nt 09 Title=Nine' in err
+    assert 'Title=One' not in err
@@ -0,0 +1,84 @@
+import pytest
+import mutagen.flac
+import mutagen.id3
+import mutagen.mp4
+from kantag import audiofile
+from kantag.tagset import TagSet
+
+# --------------------------------------------------------------------------------------------------
+def _tags(**tags):
+    result = TagSet()
+    for tag, values in tags.items():
+        result[tag] = values
+    return result
+
+# --------------------------------------------------------------------------------------------------
+def test_update_m4a_removes_freeform_variants(tmp_path, make_m4a):
+    path = tmp_path / 'a.m4a'
+    make_m4a(path)
+    afile = mutagen.mp4.MP4(str(path))
+    afile.tags['\xa9nam'] = ['Title']
+    afile.tags['trkn'] = [(3, 12)]
+    afile.tags['covr'] = [mutagen.mp4.MP4Cover(b'img')]
+    afile.tags['----:com.apple.iTunes:musicbrainz_trackid'] = [mutagen.mp4.MP4FreeForm(b'old')]
+    afile.tags['----:com.apple.iTunes:MUSICBRAINZ WORK ID'] = [mutagen.mp4.MP4FreeForm(b'old')]
+    afile.save()
+
+    audiofile.update(str(path), _tags(musicbrainz_trackid=['new'], TrackNumber=['4/12']),
+        ['musicbrainz_workid'])
+    tags = mutagen.mp4.MP4(str(path)).tags
+    assert sorted(tags.keys()) == ['----:com.apple.iTunes:MusicBrainz Track Id', 'covr', 'trkn',
+        '\xa9nam']
+    assert tags['----:com.apple.iTunes:MusicBrainz Track Id'] == [b'new']
+    assert tags['trkn'] == [(4, 12)]
+
+    # A removal-only update removes the variants too.
+    afile = mutagen.mp4.MP4(str(path))
+    afile.tags['----:com.apple.iTunes:musicbrainz_trackid'] = [mutagen.mp4.MP4FreeForm(b'old')]
+    afile.save()
+    audiofile.update(str(path), TagSet(), ['musicbrainz_trackid', 'Title'])
+    assert sorted(mutagen.mp4.MP4(str(path)).tags.keys()) == ['covr', 'trkn']
+
+# --------------------------------------------------------------------------------------------------
+def test_update_flac_matches_any_case(tmp_path, make_flac):
+    path = tmp_path / 'a.flac'
+    make_flac(path)
+    afile = mutagen.flac.FLAC(str(path))
+    afile['MUSICBRAINZ_TRACKID'] = 'old'
+    afile['Work'] = 'old'
+    afile['TITLE'] = 'Title'
+    picture = mutagen.flac.Picture()
+    picture.data = b'img'
+    afile.add_picture(picture)
+    afile.save()
+
+    audiofile.update(str(path), _tags(musicbrainz_trackid=['new']), ['Work'])
+    afile = mutagen.flac.FLAC(str(path))
+    assert sorted((key.lower(), value) for key, value in afile.tags) == [
+        ('musicbrainz_trackid', 'new'), ('title', 'Title')]
+    assert len(afile.pictures) == 1
+
+# --------------------------------------------------------------------------------------------------
+def test_update_mp3_splits_partly_changed_frame(tmp_path):
+    path = tmp_path / 'a.mp3'
+    afile = mutagen.id3.ID3()
+    afile.add(mutagen.id3.TIT2(encoding=3, text='Title'))
+    afile.add(mutagen.id3.TXXX(encoding=3, desc='MUSICBRAINZ TRACK ID', text='old'))
+    afile.add(mutagen.id3.TIPL(encoding=3, people=[['arranger', 'Arr'], ['writer', 'Writer']]))
+    afile.add(mutagen.id3.APIC(encoding=3, mime='image/png', type=3, desc='', data=b'img'))
+    afile.save(str(path))
+
+    audiofile.update(str(path), _tags(musicbrainz_trackid=['new'], Arranger=['New Arr']))
+    tags = [tag for tag in audiofile.read_raw(str(path), False) if tag.tag != 'EmbeddedImage']
+    # The track id is written to both a TXXX and a UFID frame, as a full write does.
+    assert sorted(tags) == sorted(audiofile.TagValue(tag, value) for tag, value in [
+        ('Title', 'Title'), ('musicbrainz_trackid', 'new'), ('musicbrainz_trackid', 'new'),
+        ('Arranger', 'New Arr'), ('Writer', 'Writer')])
+    assert len(mutagen.id3.ID3(str(path)).getall('APIC')) == 1
+
+# --------------------------------------------------------------------------------------------------
+def test_update_rejects_unknown_extension(tmp_path):
+    path = tmp_path / 'a.wav'
+    path.write_bytes(b'')
+    with pytest.raises(audiofile.exceptions.FileTypeError):
+        audiofile.update(str(path), TagSet())
@@ -0,0 +1,20 @@
+import os
+import subprocess
+import sys
+import pytest
+
+# The tools load these modules on first use, to keep their start-up time down.
+_lazy_modules = ['musicbrainzngs', 'kantag.musicbrainz', 'asyncio', 'mutagen.id3',
+    'mutagen.oggvorbis', 'mutagen.oggopus', 'mutagen.flac', 'mutagen.easymp4', 'kantag.watch']
+
+# --------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('module', ['kantag.applykan', 'kantag.showkan', 'kantag.initkan'])
+def test_import_is_lazy(module):
+    # A new interpreter is needed, since other tests will have imported these modules already.
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    code = 'import sys, {0}; print(" ".join(m for m in {1!r} if m in sys.modules))'.format(
+        module, _lazy_modules)
+    out = subprocess.run([sys.executable, '-c', code], env=env, check=True,
+        stdout=subprocess.PIPE, universal_newlines=True).stdout
+    assert out.split() == []
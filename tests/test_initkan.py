@@ -0,0 +1,76 @@
+import os
+import mutagen.flac
+import pytest
+from kantag import audiofile, initkan
+
+# --------------------------------------------------------------------------------------------------
+@pytest.fixture
+def library(tmp_path, make_flac):
+    """
+    A library folder holding one album folder of tagged flac files, with no tag file.
+    """
+    album = tmp_path / 'Artist' / 'Album'
+    album.mkdir(parents=True)
+    for number, title in (('1', 'One'), ('2', 'Two')):
+        path = album / '0{0} - {1}.flac'.format(number, title)
+        make_flac(path)
+        afile = mutagen.flac.FLAC(str(path))
+        afile.update({'ALBUM': 'Album', 'ARTIST': 'Artist', 'TITLE': title,
+            'TRACKNUMBER': number})
+        afile.save()
+    audiofile.set_cache(None)
+    return tmp_path
+
+# --------------------------------------------------------------------------------------------------
+def _run(library, *options):
+    initkan.args = initkan.parse_args(list(options) + ['-R', str(library)])
+    initkan.process_library()
+
+# --------------------------------------------------------------------------------------------------
+def _touch_audio(folder):
+    # Applying a tag file leaves the audio files newer than it.
+    for path in folder.glob('*.flac'):
+        os.utime(str(path), (path.stat().st_mtime + 10,) * 2)
+
+# --------------------------------------------------------------------------------------------------
+def test_edited_tag_file_kept(library, capsys):
+    album = library / 'Artist' / 'Album'
+    _run(library)
+    tag_file = album / 'tags.kan'
+    with tag_file.open('a') as f:
+        f.write('# my note\n')
+    _touch_audio(album)
+    capsys.readouterr()
+
+    _run(library)
+    assert tag_file.read_text().endswith('# my note\n')
+    assert 'use --force to replace it' in capsys.readouterr().err
+
+    _run(library, '--force')
+    assert '# my note' not in tag_file.read_text()
+
+# --------------------------------------------------------------------------------------------------
+def test_other_tag_file_not_duplicated(library, capsys):
+    album = library / 'Artist' / 'Album'
+    (album / 'album.kan').write_text('# my note\n')
+    _touch_audio(album)
+    _run(library)
+    assert sorted(path.name for path in album.glob('*.kan')) == ['album.kan']
+
+    # With --force, the existing file is replaced, and matches the output of a single folder.
+    _run(library, '--force')
+    assert sorted(path.name for path in album.glob('*.kan')) == ['album.kan']
+    initkan.args = initkan.parse_args(sorted(str(path) for path in album.glob('*.flac')))
+    capsys.readouterr()
+    initkan.process_files()
+    assert (album / 'album.kan').read_text() + '\n' == capsys.readouterr().out
+
+# --------------------------------------------------------------------------------------------------
+def test_several_tag_files_skipped(library, capsys):
+    album = library / 'Artist' / 'Album'
+    (album / 'album.kan').write_text('# one\n')
+    (album / 'tags.kan').write_text('# two\n')
+    _run(library, '--force')
+    assert (album / 'album.kan').read_text() == '# one\n'
+    assert (album / 'tags.kan').read_text() == '# two\n'
+    assert 'more than one tag file' in capsys.readouterr().err
@@ -0,0 +1,60 @@
+import sqlite3
+import pytest
+from kantag import mbcache, musicbrainz
+
+# --------------------------------------------------------------------------------------------------
+@pytest.fixture
+def calls(monkeypatch):
+    """
+    The (entity type, MBID) pairs requested from a stand-in for the musicbrainz API.
+    """
+    calls = []
+    for entity in ('release', 'recording', 'work'):
+        def get_by_id(mbid, includes=None, entity=entity):
+            calls.append((entity, mbid))
+            return {'id': mbid}
+        monkeypatch.setattr(musicbrainz.ngs, 'get_{0}_by_id'.format(entity), get_by_id)
+    yield calls
+    musicbrainz.set_cache(None)
+
+# --------------------------------------------------------------------------------------------------
+def _run(path, offline=False):
+    """
+    Fetch a release, its recordings, and a work, as a run of initkan would, with a newly opened
+    cache.
+    """
+    cache = mbcache.ResponseCache(str(path))
+    musicbrainz.set_cache(cache, offline)
+    try:
+        musicbrainz.prefetch(recordings=['r1', 'r2'], rate=1000)
+        musicbrainz.get_release_by_id('rel')
+        for mbid in ('r1', 'r2'):
+            assert musicbrainz.get_recording_by_id(mbid) == {'id': mbid}
+        musicbrainz.get_work_by_id('w')
+    finally:
+        musicbrainz.set_cache(None)
+        cache.close()
+
+# --------------------------------------------------------------------------------------------------
+def test_second_run_makes_no_calls(calls, tmp_path):
+    path = tmp_path / 'musicbrainz.sqlite'
+    _run(path)
+    assert sorted(calls) == [('recording', 'r1'), ('recording', 'r2'), ('release', 'rel'),
+        ('work', 'w')]
+    calls.clear()
+    _run(path)
+    assert calls == []
+
+# --------------------------------------------------------------------------------------------------
+def test_expired_entries_fetched_again(calls, tmp_path):
+    path = tmp_path / 'musicbrainz.sqlite'
+    _run(path)
+    with sqlite3.connect(str(path)) as db:
+        db.execute('UPDATE responses SET fetched = fetched - ?',
+            ((mbcache.default_ttl_days + 1) * 24 * 60 * 60,))
+    # Offline mode uses expired entries.
+    calls.clear()
+    _run(path, offline=True)
+    assert calls == []
+    _run(path)
+    assert len(calls) == 4
@@ -0,0 +1,37 @@
+import pytest
+from kantag import musicbrainz
+
+# --------------------------------------------------------------------------------------------------
+@pytest.fixture
+def calls(monkeypatch):
+    """
+    The work MBIDs requested from a stand-in for the musicbrainz API, with no cache set.
+    """
+    calls = []
+    def get_work_by_id(mbid, includes=None):
+        calls.append(mbid)
+        return {'id': mbid}
+    monkeypatch.setattr(musicbrainz.ngs, 'get_work_by_id', get_work_by_id)
+    musicbrainz.set_cache(None)
+    yield calls
+    musicbrainz.clear_prefetched()
+
+# --------------------------------------------------------------------------------------------------
+def test_prefetched_response_served(calls):
+    assert musicbrainz.prefetch(works=['a'], rate=1000) == 1
+    assert musicbrainz.get_work_by_id('a') == {'id': 'a'}
+    assert calls == ['a']
+
+# --------------------------------------------------------------------------------------------------
+def test_prefetch_discards_earlier_batch(calls):
+    musicbrainz.prefetch(works=['a'], rate=1000)
+    musicbrainz.prefetch(works=['b'], rate=1000)
+    assert list(musicbrainz._prefetched) == [('work', 'b')]
+    musicbrainz.get_work_by_id('a')
+    assert calls == ['a', 'b', 'a']
+
+# --------------------------------------------------------------------------------------------------
+def test_set_cache_discards_prefetched(calls):
+    musicbrainz.prefetch(works=['a'], rate=1000)
+    musicbrainz.set_cache(None)
+    assert len(musicbrainz._prefetched) == 0
@@ -0,0 +1,46 @@
+import pytest
+from kantag import audiofile, tagcache
+from kantag.util import TagValue
+
+# --------------------------------------------------------------------------------------------------
+@pytest.fixture
+def cache(tmp_path):
+    cache = tagcache.TagCache(str(tmp_path / 'tags.sqlite'))
+    yield cache
+    audiofile.set_cache(None)
+
+# --------------------------------------------------------------------------------------------------
+def test_put_get_delete(cache, tmp_path):
+    path = tmp_path / '01 - One.flac'
+    path.write_bytes(b'x')
+    tags = [TagValue('Title', 'One')]
+    cache.put(path, tags)
+    assert cache.get(path) == tags
+    cache.delete(path)
+    assert cache.get(path) is None
+
+# --------------------------------------------------------------------------------------------------
+def test_write_invalidates_without_reading(cache, tmp_path, monkeypatch):
+    path = str(tmp_path / '01 - One.flac')
+    with open(path, 'wb') as f:
+        f.write(b'x')
+    cache.put(path, [TagValue('Title', 'Old')])
+    audiofile.set_cache(cache)
+    monkeypatch.setattr(audiofile, '_write_flac', lambda path, tagset: None)
+    def read(path, warn):
+        raise AssertionError('file read after write')
+    monkeypatch.setattr(audiofile, '_read_raw', read)
+    audiofile.write(path, {'Title': ['New']})
+    assert cache.get(path) is None
+
+# --------------------------------------------------------------------------------------------------
+def test_database_error_disables_cache(cache, tmp_path, capsys):
+    path = tmp_path / '01 - One.flac'
+    path.write_bytes(b'x')
+    # Any further use of a closed connection raises sqlite3.ProgrammingError.
+    cache._db.close()
+    cache.put(path, [TagValue('Title', 'One')])
+    assert cache.get(path) is None
+    cache.delete(path)
+    err = capsys.readouterr().err
+    assert err.count('warning: tag cache disabled') == 1
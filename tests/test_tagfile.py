@@ -0,0 +1,85 @@
+import io
+import pytest
+from kantag import exceptions
+from kantag.rangeset import RangeSet
+from kantag.tagfile import TagLine, TagFile, TagFileBuilder
+from kantag.tagstores import Track
+
+# --------------------------------------------------------------------------------------------------
+def test_parsed_range():
+    line = TagLine('t 01-03,05 Title=Song')
+    assert isinstance(line.applies_to, RangeSet)
+    assert str(line) == 't 01-03,05 Title=Song'
+    assert line.applies(None, '02')
+    assert not line.applies(None, '04')
+
+# --------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('line', ['t 3/12 Title=Song', 't A1 Title=Song', 'd x Disc=1'])
+def test_parse_rejects_malformed_range(line):
+    with pytest.raises(exceptions.TagFileFormatError):
+        TagLine(line)
+
+# --------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('num', ['3/12', 'A1'])
+def test_generated_number_kept_as_is(num):
+    # Track numbers read from ID3/MP4 or vinyl rips are written as they were read.
+    line = TagLine(None, 't', num, 'Title', 'Song', warn=False)
+    assert str(line) == 't %s Title=Song' % num
+    assert line.applies(None, num)
+    assert not line.applies(None, '3')
+    assert not line.applies(None, '1')
+
+# --------------------------------------------------------------------------------------------------
+def test_generated_number_matching():
+    tags = TagFile()
+    tags.lines = [
+        TagLine(None, 'a', '', 'Album', 'Album', warn=False),
+        TagLine(None, 't', '3/12', 'Title', 'Three', warn=False),
+        TagLine(None, 't', 'A1', 'Title', 'Side A', warn=False),
+        ]
+    assert tags.get_matching(None, '3/12') == {'Album': ['Album'], 'Title': ['Three']}
+    assert tags.get_matching(None, 'A1') == {'Album': ['Album'], 'Title': ['Side A']}
+    assert tags.get_matching(None, '3') == {'Album': ['Album']}
+
+# --------------------------------------------------------------------------------------------------
+def test_generated_output_parses():
+    builder = TagFileBuilder(warn=False)
+    builder.tags.lines.append(TagLine(None, 't', '01-03', 'Title', 'Song', warn=False))
+    text = str(builder.tags)
+    reread = TagFileBuilder(reader=io.StringIO(text), warn=False).tags
+    assert str(reread) == text
+
+# --------------------------------------------------------------------------------------------------
+def _tracks(*numbers):
+    tracks = []
+    for number in numbers:
+        track = Track(number)
+        track.tags.append('Title', 'Song ' + number)
+        tracks.append(track)
+    return tracks
+
+# --------------------------------------------------------------------------------------------------
+def test_builder_keeps_non_numeric_track():
+    builder = TagFileBuilder(warn=False)
+    for track in _tracks('3/12', 'A1'):
+        builder.add_values(track, 'Title')
+    assert str(builder.tags) == 't 3/12 Title=Song 3/12\nt A1 Title=Song A1'
+
+# --------------------------------------------------------------------------------------------------
+def test_builder_groups_values():
+    tracks = _tracks('1', '2', '3', '5')
+    for track in tracks:
+        track.tags.append('Composer', 'A' if track.number != '3' else 'B')
+    builder = TagFileBuilder(warn=False)
+    builder.add_values(tracks, 'Composer')
+    assert str(builder.tags) == 't 01-02,05 Composer=A\nt 03 Composer=B'
+
+# --------------------------------------------------------------------------------------------------
+def test_builder_rejects_non_numeric_group():
+    tracks = _tracks('3/12', '4/12')
+    for track in tracks:
+        track.tags.append('Composer', 'A')
+    builder = TagFileBuilder(warn=False)
+    with pytest.raises(exceptions.TrackNumberError) as info:
+        builder.add_values(tracks, 'Composer')
+    assert info.value.number == '3/12'
@@ -0,0 +1,24 @@
+from kantag.listdict import ListDict
+from kantag.tagset import TagSet
+
+# --------------------------------------------------------------------------------------------------
+def _tags(cls, performers, title):
+    tags = cls()
+    tags['Performer'] = list(performers)
+    tags['Title'] = [title]
+    tags['Album'] = ['Album']
+    return tags
+
+# --------------------------------------------------------------------------------------------------
+def test_common_values_match_listdict():
+    # Lists longer than the set threshold are checked against the set kept by the TagSet.
+    performers = [['P{0}'.format(n) for n in range(20)], ['P{0}'.format(n) for n in range(5, 30)],
+        ['P{0}'.format(n) for n in range(2, 12)] + ['P3']]
+    tagsets = [_tags(TagSet, p, 'Song') for p in performers]
+    listdicts = [_tags(ListDict, p, 'Song') for p in performers]
+    tagsets[1].remove('Performer', 'P7')
+    listdicts[1].remove('Performer', 'P7')
+    common = TagSet.get_common_values(tagsets)
+    assert common == ListDict.get_common_values(listdicts)
+    assert common == {'Performer': ['P5', 'P6', 'P8', 'P9', 'P10', 'P11'], 'Title': ['Song'],
+        'Album': ['Album']}
@@ -0,0 +1,19 @@
+import pytest
+from kantag import exceptions, util
+
+# --------------------------------------------------------------------------------------------------
+def test_condense_ranges():
+    assert util.condense_ranges(['05', '01', '02', '03', None]) == '01-03,05'
+    assert util.condense_ranges([]) == ''
+
+# --------------------------------------------------------------------------------------------------
+@pytest.mark.parametrize('num', ['3/12', 'A1'])
+def test_condense_ranges_single_value_unchanged(num):
+    assert util.condense_ranges([num]) == num
+
+# --------------------------------------------------------------------------------------------------
+def test_condense_ranges_non_numeric():
+    with pytest.raises(exceptions.TrackNumberError) as info:
+        util.condense_ranges(['01', 'A1'])
+    assert info.value.number == 'A1'
+    assert isinstance(info.value, exceptions.TaggingError)